@@ -1,4 +1,8 @@
+import os
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import pandas as pd
 import streamlit as st
@@ -7,12 +11,27 @@ st.title("QnA Assist API")
 
 url = 'https://XXXX/prompt_query'
 
+@st.cache_resource
+def get_session():
+    # One keep-alive pool for the whole app instead of a new TLS handshake per prompt
+    # POST /prompt_query runs a full LLM and warehouse round, so it is only replayed when it never
+    # started: a refused connection, or a 429/503 the server answered with Retry-After
+    retries = Retry(total=int(os.getenv('HTTP_RETRIES', '3')), read=0, other=0, backoff_factor=0.5, backoff_jitter=0.5,
+                    status_forcelist=[], allowed_methods=None, respect_retry_after_header=True,
+                    raise_on_status=False)
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=20, max_retries=retries))
+    session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=20, max_retries=retries))
+    return session
+
 user_prompt = st.chat_input()
 
 if user_prompt:
     input = {'prompt' : user_prompt}
-    response = requests.post(url, json = input, verify=False)
+    start = time.perf_counter()
+    response = get_session().post(url, json = input, verify=False)
     response_json = response.json()
+    st.caption(f"Answered in {time.perf_counter() - start:.1f}s")
 
     if 'data' in response_json:
         # Extract the relevant data; it's a list of dictionaries
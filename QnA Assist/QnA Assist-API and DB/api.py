@@ -0,0 +1,157 @@
+import os
+import json
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from prompts import get_system_prompt
+from pipeline import PipelineError, get_pipeline
+from conversation_memory import ConversationMemory
+from snowflake_utils import pool_metrics, warm_up
+from services import service_stats
+from http_client import host_metrics
+from sql_validator import validation_stats
+from tracing import span
+from logger_module import setup_logger, correlation_id, logging_stats
+
+logger = setup_logger()
+
+# Service configurations from environment variables
+QNA_API_MAX_CONCURRENT = int(os.getenv('QNA_API_MAX_CONCURRENT', '16'))
+QNA_API_MAX_WAITING = int(os.getenv('QNA_API_MAX_WAITING', '32'))
+QNA_API_QUEUE_TIMEOUT = float(os.getenv('QNA_API_QUEUE_TIMEOUT', '5'))
+QNA_API_RETRY_AFTER = int(os.getenv('QNA_API_RETRY_AFTER', '2'))
+QNA_API_WORKERS = int(os.getenv('QNA_API_WORKERS', '4'))
+QNA_API_PORT = int(os.getenv('QNA_API_PORT', '8000'))
+
+
+class Overloaded(Exception):
+    pass
+
+
+class ConcurrencyLimiter:
+    """Caps in-flight requests per worker; callers beyond the wait queue, or that wait
+    longer than queue_timeout, are turned away instead of piling up."""
+
+    def __init__(self, max_concurrent, max_waiting, queue_timeout):
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Overloaded()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded()
+        finally:
+            self.waiting -= 1
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+
+class PromptQuery(BaseModel):
+    prompt: str
+
+
+def _log_warm_up(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Snowflake warm-up failed: {future.exception()!r}")
+
+
+def warm_up_state(future):
+    if not future.done():
+        return "running"
+    if future.cancelled():
+        return "cancelled"
+    return "ok" if future.exception() is None else f"failed: {future.exception()!r}"
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Process-wide clients and pools, built once per worker
+    app.state.pipeline = get_pipeline()
+    app.state.limiter = ConcurrencyLimiter(QNA_API_MAX_CONCURRENT, QNA_API_MAX_WAITING, QNA_API_QUEUE_TIMEOUT)
+    # The worker accepts requests while the Snowflake connector loads in the background
+    app.state.warm_up = asyncio.get_running_loop().run_in_executor(None, warm_up)
+    app.state.warm_up.add_done_callback(_log_warm_up)
+    yield
+    await app.state.pipeline.http.aclose()
+
+
+app = FastAPI(title="QnA Assist API", lifespan=lifespan)
+
+
+def _to_records(results):
+    if hasattr(results, "to_json"):
+        return json.loads(results.to_json(orient="records", date_format="iso"))
+    if isinstance(results, list):
+        return results
+    return [results]
+
+
+@app.post("/prompt_query")
+async def prompt_query(query: PromptQuery, x_request_id: str = Header(default=None)):
+    try:
+        # The caller's request id tags this request's log records; otherwise the trace id does
+        with correlation_id(x_request_id):
+            async with app.state.limiter.slot():
+                # Requests are stateless, each one gets a fresh single-turn memory
+                memory = ConversationMemory(get_system_prompt())
+                result = await app.state.pipeline.run(query.prompt, memory)
+    except Overloaded:
+        return JSONResponse(status_code=429, content={"detail": "Too many concurrent requests, please retry."},
+                            headers={"Retry-After": str(QNA_API_RETRY_AFTER)})
+    except PipelineError as e:
+        logger.info(f"Pipeline error for prompt_query: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.exception("Unhandled error in prompt_query")
+        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
+
+    message = result["message"]
+    if "results" not in message:
+        body = {"mode": result["mode"], "message": message.get("error", message["content"]),
+                "prompt_tokens": result["prompt_tokens"], "trace_id": result["trace_id"]}
+    else:
+        with span("render", trace_id=result["trace_id"], rows=len(message["results"])):
+            data = _to_records(message["results"])
+        body = {"mode": result["mode"], "message": message["content"], "data": data,
+                "truncated": message.get("truncated", False), "prompt_tokens": result["prompt_tokens"],
+                "trace_id": result["trace_id"]}
+    if "api" in message:
+        # Hybrid answers: the API half next to the table half
+        api_message = message["api"]
+        body["api"] = {"message": api_message.get("error", api_message["content"])}
+        if "results" in api_message:
+            body["api"]["data"] = _to_records(api_message["results"])
+    return body
+
+
+@app.get("/health")
+async def health():
+    limiter = app.state.limiter
+    warm = warm_up_state(app.state.warm_up)
+    # A failed warm-up (bad key, pool error) fails every Snowflake request that follows
+    return {"status": "degraded" if warm.startswith("failed") else "ok", "warm_up": warm, "waiting": limiter.waiting, "rejected": limiter.rejected, "snowflake_pool": pool_metrics(),
+            "http_hosts": host_metrics(), "oauth_token_mints": app.state.pipeline.tokens.mints,
+            "logging": logging_stats(), "services": service_stats(),
+            "coalescing": app.state.pipeline.coalescing_stats(),
+            "llm_dispatch": app.state.pipeline.llm.stats(),
+            "sql_result_cache": app.state.pipeline.sql_cache.stats() if app.state.pipeline.sql_cache else None,
+            "sql_validation": validation_stats()}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("api:app", host="0.0.0.0", port=QNA_API_PORT, workers=QNA_API_WORKERS)
@@ -0,0 +1,217 @@
+import os
+import re
+import asyncio
+from urllib.parse import urljoin, urlsplit, quote
+import pandas as pd
+from answer_stream import FENCES
+from logger_module import setup_logger
+
+logger = setup_logger()
+
+# API plan execution configurations from environment variables
+API_MAX_CONCURRENT_CALLS = int(os.getenv('API_MAX_CONCURRENT_CALLS', '8'))
+API_MAX_PAGES = int(os.getenv('API_MAX_PAGES', '10'))
+API_MAX_FANOUT = int(os.getenv('API_MAX_FANOUT', '50'))
+
+GET_BLOCK = FENCES["GET"]
+# {{n.field}} refers to a field of call n's rows (1-based); the call runs once per distinct value
+PLACEHOLDER = re.compile(r"\{\{\s*(\d+)\.([\w.]+)\s*\}\}")
+# Keys APIs commonly wrap their row list in
+RECORD_KEYS = ("data", "items", "results", "result", "records", "value", "values", "content")
+NEXT_KEYS = ("next", "nextPage", "next_page", "nextPageUrl", "nextLink", "@odata.nextLink")
+
+
+class ApiPlanError(Exception):
+    pass
+
+
+class ApiCall:
+    __slots__ = ("number", "url", "parent", "fields")
+
+    def __init__(self, number, url):
+        self.number = number
+        self.url = url
+        refs = PLACEHOLDER.findall(url)
+        parents = {int(parent) for parent, _ in refs}
+        if len(parents) > 1:
+            raise ApiPlanError(f"Call {number} depends on more than one earlier call.")
+        self.parent = parents.pop() if parents else None
+        if self.parent is not None and not 0 < self.parent < number:
+            raise ApiPlanError(f"Call {number} refers to call {self.parent}, which does not run before it.")
+        self.fields = list(dict.fromkeys(field for _, field in refs))
+
+
+def block_urls(block):
+    return [line.strip() for line in block.splitlines() if line.strip()]
+
+def parse_plan(response):
+    """The GET calls in an LLM response, in order. One URL per line; a single block keeps the
+    old one-call behaviour."""
+    urls = [url for block in GET_BLOCK.findall(response) for url in block_urls(block)]
+    return [ApiCall(number, url) for number, url in enumerate(urls, start=1)]
+
+
+def records(payload):
+    """Flatten a JSON response to a list of row dicts."""
+    if isinstance(payload, list):
+        return [row if isinstance(row, dict) else {"value": row} for row in payload]
+    if isinstance(payload, dict):
+        for key in RECORD_KEYS:
+            if isinstance(payload.get(key), list):
+                return records(payload[key])
+        lists = [value for value in payload.values() if isinstance(value, list) and value and isinstance(value[0], dict)]
+        if len(lists) == 1:
+            return lists[0]
+        return [payload]
+    return [{"value": payload}]
+
+def next_page_url(response, payload):
+    link = response.links.get("next") if hasattr(response, "links") else None
+    if link and link.get("url"):
+        return urljoin(str(response.url), link["url"])
+    if isinstance(payload, dict):
+        for container in (payload, payload.get("links"), payload.get("_links"), payload.get("paging")):
+            if not isinstance(container, dict):
+                continue
+            for key in NEXT_KEYS:
+                value = container.get(key)
+                if isinstance(value, dict):
+                    value = value.get("href")
+                if isinstance(value, str) and value:
+                    return urljoin(str(response.url), value)
+    return None
+
+
+def same_origin(url, origin):
+    url, origin = urlsplit(url), urlsplit(origin)
+    return (url.scheme.lower(), url.netloc.lower()) == (origin.scheme.lower(), origin.netloc.lower())
+
+
+def _expand(call, parent_frame):
+    """Concrete URLs for a dependent call, one per distinct combination of the referenced fields."""
+    missing = [field for field in call.fields if field not in parent_frame.columns]
+    if missing:
+        raise ApiPlanError(f"Call {call.number} refers to {', '.join(missing)}, not returned by call {call.parent}.")
+    keys = parent_frame[call.fields].dropna().drop_duplicates()
+    if len(keys) > API_MAX_FANOUT:
+        logger.info(f"Call {call.number} fan-out capped at {API_MAX_FANOUT} of {len(keys)}")
+        keys = keys.iloc[:API_MAX_FANOUT]
+    expanded = []
+    for values in keys.itertuples(index=False, name=None):
+        key = dict(zip(call.fields, values))
+        url = PLACEHOLDER.sub(lambda match: quote(str(key[match.group(2)]), safe=""), call.url)
+        expanded.append((url, key))
+    return expanded
+
+
+class ApiExecutor:
+    """Runs an API plan: calls without dependencies run concurrently, dependent calls run once per
+    distinct parent value as soon as their parent is done, every call follows pagination, and
+    the responses are flattened and joined into one DataFrame."""
+
+    def __init__(self, fetch, max_concurrent=API_MAX_CONCURRENT_CALLS, max_pages=API_MAX_PAGES):
+        # fetch(url) -> response with .json(), .links and .url
+        self.fetch = fetch
+        self.max_pages = max_pages
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.calls = []
+        self._frames = {}
+        self._done = {}
+        self._tasks = []
+
+    async def fetch_rows(self, url):
+        rows = []
+        for _ in range(self.max_pages):
+            async with self._semaphore:
+                response = await self.fetch(url)
+            if response.status_code >= 400:
+                raise ApiPlanError(f"GET {url} returned {response.status_code}")
+            payload = response.json()
+            rows.extend(records(payload))
+            next_url = next_page_url(response, payload)
+            if next_url is None:
+                break
+            # The pooled client sends the Bearer token with every request, so paging never leaves the origin
+            if not same_origin(next_url, url):
+                logger.warning(f"Not following pagination link to another host: {urlsplit(next_url).netloc}")
+                break
+            url = next_url
+        else:
+            logger.info(f"Stopped paging after {self.max_pages} pages")
+        return rows
+
+    async def _run_call(self, call):
+        try:
+            if call.parent is None:
+                frame = pd.json_normalize(await self.fetch_rows(call.url))
+            else:
+                await self._done[call.parent].wait()
+                if call.parent not in self._frames:
+                    raise ApiPlanError(f"Call {call.number} skipped, call {call.parent} failed.")
+                expanded = _expand(call, self._frames[call.parent])
+                pages = await asyncio.gather(*(self.fetch_rows(url) for url, _ in expanded))
+                parts = []
+                for (_, key), rows in zip(expanded, pages):
+                    part = pd.json_normalize(rows)
+                    # Join key back to the parent rows that produced this call
+                    for field, value in key.items():
+                        part[f"__{call.parent}.{field}"] = value
+                    parts.append(part)
+                frame = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+            self._frames[call.number] = frame
+        finally:
+            # Dependents never wait on a call that has failed
+            self._done[call.number].set()
+
+    def submit(self, call):
+        """Start a call right away; its parent, if any, must have been submitted already."""
+        if call.parent is not None and call.parent not in self._done:
+            raise ApiPlanError(f"Call {call.number} refers to call {call.parent}, which does not run before it.")
+        self.calls.append(call)
+        self._done[call.number] = asyncio.Event()
+        self._tasks.append(asyncio.ensure_future(self._run_call(call)))
+
+    def cancel(self):
+        for task in self._tasks:
+            task.cancel()
+
+    async def result(self):
+        try:
+            await asyncio.gather(*self._tasks)
+        except BaseException:
+            self.cancel()
+            raise
+        return join_frames(self.calls, self._frames)
+
+    async def run(self, plan):
+        for call in plan:
+            self.submit(call)
+        return await self.result()
+
+
+def join_frames(plan, frames):
+    """Left-join every dependent call onto its parent; unrelated root calls are stacked with a
+    _call column."""
+    children = {}
+    for call in plan:
+        if call.parent is not None:
+            children.setdefault(call.parent, []).append(call)
+
+    def joined(call):
+        frame = frames[call.number]
+        for child in children.get(call.number, []):
+            child_frame = joined(child)
+            keys = [f"__{call.number}.{field}" for field in child.fields]
+            if child_frame.empty or not set(keys) <= set(child_frame.columns):
+                continue
+            frame = frame.merge(child_frame, how="left", left_on=child.fields, right_on=keys,
+                                suffixes=("", f"_{child.number}"))
+            frame = frame.drop(columns=keys)
+        return frame
+
+    roots = [joined(call) for call in plan if call.parent is None]
+    if len(roots) == 1:
+        return roots[0]
+    for number, frame in zip((call.number for call in plan if call.parent is None), roots):
+        frame.insert(0, "_call", number)
+    return pd.concat(roots, ignore_index=True)
@@ -0,0 +1,448 @@
+"""Offline benchmark for the QnA pipeline.
+
+Replays a question corpus through QnAPipeline with local stand-ins: a deterministic fake
+chat-completions client with configurable token latency, SQLite loaded with a synthetic
+CDL_LS.DAAS schema in place of Snowflake, and the local BM25 index in place of Azure AI Search.
+Reports per-stage p50/p95/p99 latency, throughput at N concurrent sessions, memory and the
+API worker's cold start (fresh interpreter: import, then build the pipeline) as JSON.
+
+    python benchmark.py --sessions 1,4,16 --rounds 3 --out bench.json
+    python benchmark.py --baseline bench.json --out bench-new.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import subprocess
+import asyncio
+import sqlite3
+import tempfile
+import argparse
+import platform
+import threading
+import tracemalloc
+from types import SimpleNamespace
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DEFAULT_QUESTIONS = [
+    {"question": "How many students are enrolled in each class?",
+     "sql": "SELECT c.CLASS_NAME, COUNT(*) AS STUDENTS FROM CDL_LS.DAAS.STUDENTS s "
+            "JOIN CDL_LS.DAAS.CLASSES c ON s.CLASS_ID = c.CLASS_ID GROUP BY c.CLASS_NAME"},
+    {"question": "List the teachers in the science department",
+     "sql": "SELECT TEACHER_NAME FROM CDL_LS.DAAS.TEACHERS WHERE DEPARTMENT = 'Science'"},
+    {"question": "What is the average grade score per term?",
+     "sql": "SELECT TERM, AVG(SCORE) AS AVG_SCORE FROM CDL_LS.DAAS.GRADES GROUP BY TERM ORDER BY TERM"},
+    {"question": "Show the top 10 students by average grade score",
+     "sql": "SELECT s.STUDENT_NAME, AVG(g.SCORE) AS AVG_SCORE FROM CDL_LS.DAAS.GRADES g "
+            "JOIN CDL_LS.DAAS.STUDENTS s ON g.STUDENT_ID = s.STUDENT_ID "
+            "GROUP BY s.STUDENT_NAME ORDER BY AVG_SCORE DESC LIMIT 10"},
+    {"question": "Which classes does each teacher teach?",
+     "sql": "SELECT t.TEACHER_NAME, c.CLASS_NAME FROM CDL_LS.DAAS.CLASSES c "
+            "JOIN CDL_LS.DAAS.TEACHERS t ON c.TEACHER_ID = t.TEACHER_ID"},
+    {"question": "Show all grades for students enrolled in 2023",
+     "sql": "SELECT s.STUDENT_NAME, g.TERM, g.SCORE FROM CDL_LS.DAAS.GRADES g "
+            "JOIN CDL_LS.DAAS.STUDENTS s ON g.STUDENT_ID = s.STUDENT_ID WHERE s.ENROLLED_ON LIKE '2023%'"},
+    {"question": "How many students scored above 90 in each class?",
+     "sql": "SELECT c.CLASS_NAME, COUNT(DISTINCT g.STUDENT_ID) AS STUDENTS FROM CDL_LS.DAAS.GRADES g "
+            "JOIN CDL_LS.DAAS.CLASSES c ON g.CLASS_ID = c.CLASS_ID WHERE g.SCORE > 90 GROUP BY c.CLASS_NAME"},
+    {"question": "List every student with their class name",
+     "sql": "SELECT s.STUDENT_NAME, c.CLASS_NAME FROM CDL_LS.DAAS.STUDENTS s "
+            "JOIN CDL_LS.DAAS.CLASSES c ON s.CLASS_ID = c.CLASS_ID"},
+]
+
+# Synthetic CDL_LS.DAAS schema: {table: [(column, sqlite type, snowflake type, comment)]}
+SYNTHETIC_SCHEMA = {
+    "TEACHERS": [("TEACHER_ID", "INTEGER", "NUMBER(38,0)", "Teacher key"),
+                 ("TEACHER_NAME", "TEXT", "VARCHAR(200)", "Full name of the teacher"),
+                 ("DEPARTMENT", "TEXT", "VARCHAR(100)", "Department the teacher belongs to")],
+    "CLASSES": [("CLASS_ID", "INTEGER", "NUMBER(38,0)", "Class key"),
+                ("CLASS_NAME", "TEXT", "VARCHAR(200)", "Class name"),
+                ("TEACHER_ID", "INTEGER", "NUMBER(38,0)", "Teacher of the class")],
+    "STUDENTS": [("STUDENT_ID", "INTEGER", "NUMBER(38,0)", "Student key"),
+                 ("STUDENT_NAME", "TEXT", "VARCHAR(200)", "Full name of the student"),
+                 ("CLASS_ID", "INTEGER", "NUMBER(38,0)", "Class the student is enrolled in"),
+                 ("ENROLLED_ON", "TEXT", "DATE", "Enrollment date")],
+    "GRADES": [("STUDENT_ID", "INTEGER", "NUMBER(38,0)", "Student key"),
+               ("CLASS_ID", "INTEGER", "NUMBER(38,0)", "Class key"),
+               ("TERM", "TEXT", "VARCHAR(20)", "Academic term"),
+               ("SCORE", "REAL", "NUMBER(5,2)", "Grade score out of 100")],
+}
+DEPARTMENTS = ["Science", "Mathematics", "History", "Languages", "Arts"]
+
+
+def _offline_environment(workdir):
+    """Placeholder settings so the service modules import without any live backend."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    passphrase = "benchmark"
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                            serialization.BestAvailableEncryption(passphrase.encode())).decode()
+    defaults = {
+        "SNOWFLAKE_PRIVATE_KEY": pem,
+        "daas_edp_sf_key_passphrase": passphrase,
+        "SF_POOL_SIZE": "4", "SF_POOL_MAX_OVERFLOW": "4", "SF_POOL_TIMEOUT": "30",
+        "AZURE_OPENAI_API_KEY": "benchmark", "AZURE_OPENAI_ENDPOINT": "https://benchmark.invalid",
+        "DEPLOYMENT_NAME": "benchmark",
+        "BLOB_CONNECTION_STRING": "DefaultEndpointsProtocol=https;AccountName=benchmark;AccountKey=YmVuY2htYXJr;EndpointSuffix=core.windows.net",
+        "CONTAINER_NAME": "benchmark",
+        "AISEARCH_ENDPOINT": "https://benchmark.invalid", "AISEARCH_ADMIN_KEY": "benchmark", "AISEARCH_INDEX_NAME": "benchmark",
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+    # Never touch the real local stores
+    os.environ["SEARCH_BACKEND"] = "local"
+    os.environ["LOCAL_SEARCH_INDEX_DIR"] = os.path.join(workdir, "search_index")
+    os.environ["SCHEMA_CATALOG_DIR"] = os.path.join(workdir, "schema_catalog")
+    os.environ["SQL_RESULT_CACHE_DIR"] = os.path.join(workdir, "sql_result_cache")
+    os.environ["SQL_GUARD_EXPLAIN"] = "false"
+
+
+def build_database(path, rows, seed=7):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    for table, columns in SYNTHETIC_SCHEMA.items():
+        conn.execute(f"CREATE TABLE {table} ({', '.join(f'{name} {sqlite_type}' for name, sqlite_type, _, _ in columns)})")
+    teachers = max(rows // 200, 5)
+    classes = max(rows // 50, 10)
+    conn.executemany("INSERT INTO TEACHERS VALUES (?, ?, ?)",
+                     [(i, f"Teacher {i}", DEPARTMENTS[i % len(DEPARTMENTS)]) for i in range(teachers)])
+    conn.executemany("INSERT INTO CLASSES VALUES (?, ?, ?)",
+                     [(i, f"Class {i}", rng.randrange(teachers)) for i in range(classes)])
+    conn.executemany("INSERT INTO STUDENTS VALUES (?, ?, ?, ?)",
+                     [(i, f"Student {i}", rng.randrange(classes), f"{rng.choice([2021, 2022, 2023, 2024])}-09-01")
+                      for i in range(rows)])
+    conn.executemany("INSERT INTO GRADES VALUES (?, ?, ?, ?)",
+                     [(rng.randrange(rows), rng.randrange(classes), f"T{rng.randint(1, 4)}", round(rng.uniform(40, 100), 2))
+                      for _ in range(rows * 4)])
+    conn.commit()
+    conn.close()
+
+
+def synthetic_catalog(database, schema):
+    from schema_catalog import SchemaCatalog
+    catalog = SchemaCatalog(database, schema)
+    catalog._tables = {
+        table: {"last_altered": "1970-01-01T00:00:00",
+                "columns": [{"name": name, "type": sf_type, "nullable": not name.endswith("_ID"), "default": None,
+                             "comment": comment} for name, _, sf_type, comment in columns]}
+        for table, columns in SYNTHETIC_SCHEMA.items()}
+    catalog.ready.set()
+    return catalog
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def summary(self):
+        def percentile(values, q):
+            return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+        result = {}
+        with self._lock:
+            for stage, values in sorted(self.samples.items()):
+                values = sorted(values)
+                result[stage] = {"count": len(values), "mean_ms": round(sum(values) / len(values) * 1000, 2),
+                                 "p50_ms": percentile(values, 0.50), "p95_ms": percentile(values, 0.95),
+                                 "p99_ms": percentile(values, 0.99)}
+        return result
+
+
+class FakeChatCompletions:
+    """Deterministic stand-in for AsyncAzureOpenAI: answers with the corpus SQL for the last user
+    prompt, streamed in ~4 character tokens after ttft seconds, token_latency seconds apart."""
+
+    def __init__(self, answers, ttft=0.3, token_latency=0.01, prose_tokens=40):
+        self.answers = answers
+        self.ttft = ttft
+        self.token_latency = token_latency
+        self.prose = " The query joins the relevant tables and aggregates the requested values." * max(prose_tokens // 12, 1)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _answer(self, messages):
+        prompt = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        sql = self.answers.get(prompt) or next(iter(self.answers.values()))
+        return f"Here is the query:\n```sql\n{sql}\n```\n{self.prose}"
+
+    async def create(self, model=None, messages=(), stream=False, **kwargs):
+        text = self._answer(messages)
+
+        async def chunks():
+            await asyncio.sleep(self.ttft)
+            for start in range(0, len(text), 4):
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text[start:start + 4]))])
+                await asyncio.sleep(self.token_latency)
+        return chunks()
+
+
+def _bench_pipeline_class(pipeline_module, recorder, database_path):
+    import sqlglot
+    from sqlglot import exp
+    from result_fetch import ResultPager, _RowsBatch, RESULT_MAX_ROWS
+    from sql_guard import prepare_select
+
+    local = threading.local()
+
+    def sqlite_connection():
+        if not hasattr(local, "conn"):
+            local.conn = sqlite3.connect(database_path)
+        return local.conn
+
+    def to_sqlite(sql):
+        statement = sqlglot.parse_one(prepare_select(sql), read="snowflake")
+        for table in statement.find_all(exp.Table):
+            table.set("db", None)
+            table.set("catalog", None)
+        return statement.sql(dialect="sqlite")
+
+    class BenchPipeline(pipeline_module.QnAPipeline):
+        async def retrieve(self, prompt):
+            with recorder.stage("search"):
+                return await super().retrieve(prompt)
+
+        async def complete(self, messages, on_token=None, on_block=None, fence="sql"):
+            start = time.perf_counter()
+            first = []
+
+            def token(text):
+                if not first:
+                    first.append(time.perf_counter() - start)
+                if on_token:
+                    on_token(text)
+            with recorder.stage("llm_total"):
+                response = await super().complete(messages, token, on_block, fence)
+            if first:
+                recorder.add("llm_ttft", first[0])
+            return response
+
+        async def execute_sql(self, sql, on_page=None):
+            # Same guard and paging path as Snowflake, executed against SQLite
+            def execute():
+                cursor = sqlite_connection().execute(to_sqlite(sql))
+                columns = [desc[0] for desc in cursor.description]
+                pager = ResultPager([_RowsBatch(cursor.fetchmany(RESULT_MAX_ROWS + 1))], columns)
+                for page in pager:
+                    if on_page:
+                        on_page(page)
+                return pager.to_frame()
+            with recorder.stage("sql"):
+                return await asyncio.to_thread(execute)
+
+    return BenchPipeline
+
+
+async def _session(pipeline, memory_factory, questions, recorder, errors):
+    for question in questions:
+        memory = memory_factory()
+        start = time.perf_counter()
+        try:
+            result = await pipeline.run(question, memory)
+            if "results" not in result["message"]:
+                errors.append(result["message"].get("content"))
+        except Exception as e:
+            errors.append(str(e))
+        recorder.add("total", time.perf_counter() - start)
+
+
+async def _run_sessions(pipeline, memory_factory, corpus, sessions, rounds, seed):
+    recorder = pipeline.recorder
+    errors = []
+    plans = []
+    for number in range(sessions):
+        rng = random.Random(seed + number)
+        questions = [item["question"] for item in corpus] * rounds
+        rng.shuffle(questions)
+        plans.append(questions)
+    start = time.perf_counter()
+    await asyncio.gather(*(_session(pipeline, memory_factory, questions, recorder, errors) for questions in plans))
+    return time.perf_counter() - start, sum(len(questions) for questions in plans), errors
+
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+COLD_START_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import api
+imported = time.perf_counter()
+api.get_pipeline()
+built = time.perf_counter()
+print(json.dumps({"import_s": imported - started, "pipeline_s": built - imported, "modules": len(sys.modules)}))
+"""
+
+
+def measure_cold_start(repeats):
+    """Best of repeats fresh interpreters importing the API worker and building its pipeline."""
+    samples = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), env=os.environ, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    best = min(samples, key=lambda sample: sample["import_s"] + sample["pipeline_s"])
+    return {"import_s": round(best["import_s"], 3), "pipeline_s": round(best["pipeline_s"], 3),
+            "total_s": round(best["import_s"] + best["pipeline_s"], 3), "modules": best["modules"]}
+
+
+def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix="qna-bench-")
+    try:
+        return _run_benchmark(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _run_benchmark(args, workdir):
+    _offline_environment(workdir)
+
+    import pipeline as pipeline_module
+    import schema_catalog
+    from prompts import DB, SCHEMA
+    from local_search import LocalSearchIndex, build_index, documents_from_catalog
+    from answer_cache import AnswerCache, MemoryBackend
+    from conversation_memory import ConversationMemory
+    from prompts import get_system_prompt
+    from llm_dispatch import LlmDispatcher, Deployment
+
+    corpus = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, 'r') as file:
+            corpus = json.load(file)
+
+    database_path = os.path.join(workdir, "cdl_ls_daas.sqlite")
+    build_database(database_path, args.rows)
+    catalog = synthetic_catalog(DB, SCHEMA)
+    schema_catalog._catalogs[(DB.upper(), SCHEMA.upper())] = catalog
+    build_index(documents_from_catalog(catalog), os.environ["LOCAL_SEARCH_INDEX_DIR"])
+
+    llm = FakeChatCompletions({item["question"]: item["sql"] for item in corpus},
+                              ttft=args.ttft, token_latency=args.token_latency, prose_tokens=args.prose_tokens)
+    system_prompt = get_system_prompt()
+
+    # Prompt building runs inside QnAPipeline.run, so it is timed at the module function
+    current = {}
+    build_prompt = pipeline_module.get_tables_prompt
+
+    def timed_prompt(*prompt_args):
+        with current["recorder"].stage("prompt_build"):
+            return build_prompt(*prompt_args)
+    pipeline_module.get_tables_prompt = timed_prompt
+
+    def memory_factory():
+        return ConversationMemory(system_prompt)
+
+    report = {
+        "config": {"rows": args.rows, "questions": len(corpus), "rounds": args.rounds, "ttft": args.ttft,
+                   "token_latency": args.token_latency, "prose_tokens": args.prose_tokens, "tpm": args.tpm, "rpm": args.rpm,
+                   "answer_cache": args.answer_cache, "python": platform.python_version()},
+        "runs": [],
+    }
+    if args.cold_start:
+        report["cold_start"] = measure_cold_start(args.cold_start)
+        print(f"Cold start: {report['cold_start']['total_s']}s ({report['cold_start']['modules']} modules)", file=sys.stderr)
+    if args.tracemalloc:
+        tracemalloc.start()
+    for sessions in args.sessions:
+        recorder = current["recorder"] = Recorder()
+        BenchPipeline = _bench_pipeline_class(pipeline_module, recorder, database_path)
+        # The fake is dispatched like a real deployment, under the quota given with --tpm/--rpm
+        dispatcher = LlmDispatcher([Deployment("benchmark", tpm=args.tpm, rpm=args.rpm, async_client=llm)])
+        pipeline = BenchPipeline(dispatcher, search=LocalSearchIndex(os.environ["LOCAL_SEARCH_INDEX_DIR"]))
+        pipeline.recorder = recorder
+        if not args.answer_cache:
+            pipeline.answer_cache = AnswerCache(MemoryBackend(max_entries=0))
+        if args.tracemalloc:
+            tracemalloc.reset_peak()
+        wall, requests, errors = asyncio.run(_run_sessions(pipeline, memory_factory, corpus, sessions, args.rounds, args.seed))
+        run = {"sessions": sessions, "requests": requests, "errors": len(errors), "wall_s": round(wall, 3),
+               "throughput_rps": round(requests / wall, 2) if wall else None, "stages": recorder.summary(),
+               "memory": {"max_rss_mb": _max_rss_mb()}, "coalescing": pipeline.coalescing_stats(),
+               "llm_dispatch": dispatcher.stats()}
+        if args.tracemalloc:
+            run["memory"]["python_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+        if errors:
+            run["first_error"] = errors[0]
+        report["runs"].append(run)
+        print(f"{sessions} sessions: {requests} requests in {wall:.2f}s ({run['throughput_rps']} req/s), "
+              f"total p95 {run['stages']['total']['p95_ms']} ms, {len(errors)} errors", file=sys.stderr)
+    return report
+
+
+def compare_reports(baseline, current):
+    """p50/p95 change per stage against a previous report, matched by session count."""
+    previous = {run["sessions"]: run for run in baseline.get("runs", [])}
+    comparison = []
+    for run in current["runs"]:
+        before = previous.get(run["sessions"])
+        if before is None:
+            continue
+        stages = {}
+        for stage, stats in run["stages"].items():
+            old = before["stages"].get(stage)
+            if old:
+                stages[stage] = {f"{q}_change_pct": round((stats[f"{q}_ms"] - old[f"{q}_ms"]) / old[f"{q}_ms"] * 100, 1)
+                                 if old[f"{q}_ms"] else None for q in ("p50", "p95")}
+        comparison.append({"sessions": run["sessions"], "stages": stages,
+                           "throughput_change_pct": round((run["throughput_rps"] - before["throughput_rps"])
+                                                          / before["throughput_rps"] * 100, 1)})
+    return comparison
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline latency/throughput benchmark of the QnA pipeline")
+    parser.add_argument("--questions", help="JSON list of {question, sql}; defaults to a built-in corpus")
+    parser.add_argument("--sessions", default="1,4,16", help="Comma separated concurrent session counts")
+    parser.add_argument("--rounds", type=int, default=3, help="Times each session replays the corpus")
+    parser.add_argument("--rows", type=int, default=20000, help="Students in the synthetic database")
+    parser.add_argument("--ttft", type=float, default=0.3, help="Fake LLM time to first token (seconds)")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Fake LLM delay between tokens (seconds)")
+    parser.add_argument("--prose-tokens", type=int, default=40, help="Tokens of prose after the SQL block")
+    parser.add_argument("--tpm", type=int, default=10_000_000, help="Token quota of the fake deployment")
+    parser.add_argument("--rpm", type=int, default=60_000, help="Request quota of the fake deployment")
+    parser.add_argument("--answer-cache", action="store_true", help="Keep the answer cache enabled")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also report the Python heap peak (slower)")
+    parser.add_argument("--cold-start", type=int, default=3, help="Fresh interpreters timed for cold start; 0 skips it")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--baseline", help="Previous JSON report to compare against")
+    # Not stdout: the application logger writes there
+    parser.add_argument("--out", default="benchmark_results.json", help="Where to write the JSON report")
+    args = parser.parse_args()
+    args.sessions = [int(value) for value in args.sessions.split(",") if value]
+
+    report = run_benchmark(args)
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        report["comparison"] = compare_reports(baseline, report)
+        if "cold_start" in baseline and "cold_start" in report:
+            report["cold_start"]["change_pct"] = round((report["cold_start"]["total_s"] - baseline["cold_start"]["total_s"])
+                                                       / baseline["cold_start"]["total_s"] * 100, 1)
+    with open(args.out, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Report written to {args.out}", file=sys.stderr)
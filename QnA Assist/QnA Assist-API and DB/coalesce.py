@@ -0,0 +1,113 @@
+import asyncio
+import threading
+from logger_module import setup_logger
+
+logger = setup_logger()
+
+
+class Broadcast:
+    """Fans one execution's streamed text and result pages out to every caller sharing it.
+    A caller joining late is first given the text so far and the pages already sent."""
+
+    def __init__(self):
+        self.text = None
+        self.pages = []
+        self._token_subscribers = []
+        self._page_subscribers = []
+        # Pages arrive from a worker thread
+        self._lock = threading.Lock()
+
+    def subscribe(self, on_token=None, on_page=None):
+        with self._lock:
+            if on_token is not None:
+                if self.text is not None:
+                    _deliver(on_token, self.text)
+                self._token_subscribers.append(on_token)
+            if on_page is not None:
+                for page in self.pages:
+                    _deliver(on_page, page)
+                self._page_subscribers.append(on_page)
+
+    def unsubscribe(self, on_token=None, on_page=None):
+        with self._lock:
+            if on_token in self._token_subscribers:
+                self._token_subscribers.remove(on_token)
+            if on_page in self._page_subscribers:
+                self._page_subscribers.remove(on_page)
+
+    def on_token(self, text):
+        with self._lock:
+            self.text = text
+            subscribers = list(self._token_subscribers)
+        for subscriber in subscribers:
+            _deliver(subscriber, text)
+
+    def on_page(self, page):
+        with self._lock:
+            self.pages.append(page)
+            subscribers = list(self._page_subscribers)
+        for subscriber in subscribers:
+            _deliver(subscriber, page)
+
+
+def _deliver(callback, value):
+    # One caller's broken callback must not fail the execution the others are waiting on
+    try:
+        callback(value)
+    except Exception as e:
+        logger.warning(f"Coalesced subscriber callback failed: {str(e)}")
+
+
+class _Flight:
+    __slots__ = ("task", "broadcast", "waiters")
+
+    def __init__(self, task, broadcast):
+        self.task = task
+        self.broadcast = broadcast
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces identical in-flight work: the first caller for a key starts it, callers arriving
+    before it finishes await the same task. The work is cancelled only once every caller has
+    gone away. Single event loop only."""
+
+    def __init__(self, name):
+        self.name = name
+        self._flights = {}
+        self.metrics = {"executed": 0, "coalesced": 0, "abandoned": 0}
+
+    async def do(self, key, run, on_token=None, on_page=None):
+        """run(broadcast) returns the coroutine doing the work; it should stream through
+        broadcast.on_token/on_page, which reach every caller's on_token/on_page."""
+        flight = self._flights.get(key)
+        if flight is None:
+            broadcast = Broadcast()
+            flight = _Flight(asyncio.ensure_future(run(broadcast)), broadcast)
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _, flight=flight: self._forget(key, flight))
+            self.metrics["executed"] += 1
+        else:
+            self.metrics["coalesced"] += 1
+            logger.debug(f"{self.name}: joined in-flight request, {flight.waiters} already waiting")
+        flight.broadcast.subscribe(on_token, on_page)
+        flight.waiters += 1
+        try:
+            # Shielded, so one caller cancelling doesn't cancel the others' result
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            flight.broadcast.unsubscribe(on_token, on_page)
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+                self.metrics["abandoned"] += 1
+
+    def in_flight(self, key):
+        return key in self._flights
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self):
+        return dict(self.metrics, in_flight=len(self._flights))
@@ -0,0 +1,116 @@
+import os
+import re
+from token_count import count_tokens
+from logger_module import setup_logger
+
+logger = setup_logger()
+
+SCHEMA_CONTEXT_TOKEN_BUDGET = int(os.getenv('SCHEMA_CONTEXT_TOKEN_BUDGET', '1500'))
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+def _words(text):
+    return set(_WORD.findall((text or "").lower()))
+
+def _is_key(name):
+    upper = name.upper()
+    return upper == 'ID' or upper.endswith('_ID') or upper.endswith('_KEY')
+
+def _column_line(column, shared_keys, last=False):
+    line = f"  {column['name']} {column['type']}"
+    if not column.get("nullable", True):
+        line += " NOT NULL"
+    if not last:
+        line += ","
+    if column['name'].upper() in shared_keys:
+        line += " -- join key"
+    elif _is_key(column['name']):
+        line += " -- key"
+    return line
+
+def describe_rows(columns):
+    # The rows DESCRIBE TABLE returned for these columns, as the context used to embed them
+    return [(column['name'], column['type'], 'COLUMN', 'Y' if column.get("nullable", True) else 'N',
+             column.get("default"), 'N', 'N', None, None, column.get("comment"), None, None) for column in columns]
+
+def _render(tables, kept, shared_keys):
+    blocks = []
+    for table, columns in tables.items():
+        if table not in kept:
+            continue
+        selected = [column for ordinal, column in enumerate(columns) if ordinal in kept[table]]
+        lines = [_column_line(column, shared_keys, last=index == len(selected) - 1) for index, column in enumerate(selected)]
+        omitted = len(columns) - len(selected)
+        if omitted:
+            lines.append(f"  -- {omitted} more columns omitted")
+        blocks.append(f"TABLE {table} (\n" + "\n".join(lines) + "\n)")
+    dropped = len(tables) - len(kept)
+    if dropped:
+        blocks.append(f"-- {dropped} more tables omitted")
+    return "\n".join(blocks)
+
+def render_tables_context(tables, prompt="", token_budget=SCHEMA_CONTEXT_TOKEN_BUDGET):
+    """Render {table: [column dicts]} as compact DDL within token_budget: join keys first, then
+    other keys, then the columns most relevant to the prompt. Returns (text, stats)."""
+    prompt_words = _words(prompt)
+
+    # Key columns that appear in more than one table are likely join paths
+    seen = {}
+    for columns in tables.values():
+        for column in columns:
+            if _is_key(column['name']):
+                seen[column['name'].upper()] = seen.get(column['name'].upper(), 0) + 1
+    shared_keys = {name for name, count in seen.items() if count > 1}
+
+    # Every table's header and a possible omission line are reserved, columns compete for the rest
+    kept = {table: set() for table in tables}
+    used = 0
+    candidates = []
+    for table_index, (table, columns) in enumerate(tables.items()):
+        used += count_tokens(f"TABLE {table} (\n  -- {len(columns)} more columns omitted\n)\n")
+        table_match = 0.5 if _words(table) & prompt_words else 0
+        for ordinal, column in enumerate(columns):
+            line_tokens = count_tokens(_column_line(column, shared_keys) + "\n")
+            if column['name'].upper() in shared_keys:
+                rank = (0, 0)
+            elif _is_key(column['name']):
+                rank = (1, 0)
+            else:
+                words = _words(column['name']) | _words(column.get('comment'))
+                rank = (2, -(len(words & prompt_words) + table_match))
+            candidates.append((rank, table_index, ordinal, table, line_tokens))
+
+    # Deterministic order: rank first, then table order, then column position
+    picked = []
+    for _, _, ordinal, table, line_tokens in sorted(candidates):
+        if used + line_tokens > token_budget:
+            continue
+        kept[table].add(ordinal)
+        picked.append((table, ordinal))
+        used += line_tokens
+
+    # Token counts aren't additive across lines; trim until the rendered text itself fits
+    text = _render(tables, kept, shared_keys)
+    tokens = count_tokens(text)
+    while tokens > token_budget and kept:
+        if picked:
+            table, ordinal = picked.pop()
+            kept[table].discard(ordinal)
+        else:
+            kept.pop(list(kept)[-1])
+        text = _render(tables, kept, shared_keys)
+        tokens = count_tokens(text)
+    if tokens > token_budget:
+        text, tokens = "", 0
+
+    # The old context was the raw DESCRIBE TABLE rows of every table
+    baseline_tokens = count_tokens(str({table: describe_rows(columns) for table, columns in tables.items()}))
+    stats = {
+        "tokens": tokens,
+        "baseline_tokens": baseline_tokens,
+        "tokens_saved": max(baseline_tokens - tokens, 0),
+        "columns_total": sum(len(columns) for columns in tables.values()),
+        "columns_kept": sum(len(ordinals) for ordinals in kept.values()),
+        "tables_omitted": len(tables) - len(kept),
+    }
+    return text, stats
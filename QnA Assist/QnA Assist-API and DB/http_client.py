@@ -0,0 +1,188 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+import httpx
+from logger_module import setup_logger
+
+logger = setup_logger()
+
+# HTTP client configurations from environment variables
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '60'))
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '100'))
+HTTP_MAX_KEEPALIVE = int(os.getenv('HTTP_MAX_KEEPALIVE', '20'))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '60'))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '3'))
+HTTP_BACKOFF_BASE = float(os.getenv('HTTP_BACKOFF_BASE', '0.25'))
+HTTP_BACKOFF_MAX = float(os.getenv('HTTP_BACKOFF_MAX', '5'))
+OAUTH_REFRESH_MARGIN = float(os.getenv('OAUTH_REFRESH_MARGIN', '120'))
+
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class HostMetrics:
+    """Request count, errors and latency percentiles per host."""
+
+    def __init__(self, window=512):
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self.window = window
+
+    def record(self, url, seconds, error=False):
+        host = urlsplit(str(url)).netloc
+        with self._lock:
+            stats = self._hosts.get(host)
+            if stats is None:
+                stats = self._hosts[host] = {"requests": 0, "errors": 0, "retries": 0, "latencies": deque(maxlen=self.window)}
+            stats["requests"] += 1
+            stats["errors"] += int(error)
+            stats["latencies"].append(seconds)
+
+    def retried(self, url):
+        host = urlsplit(str(url)).netloc
+        with self._lock:
+            if host in self._hosts:
+                self._hosts[host]["retries"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for host, stats in self._hosts.items():
+                latencies = sorted(stats["latencies"])
+                def percentile(p):
+                    return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1) if latencies else None
+                result[host] = {"requests": stats["requests"], "errors": stats["errors"], "retries": stats["retries"],
+                                "p50_ms": percentile(0.50), "p95_ms": percentile(0.95), "max_ms": percentile(1.0)}
+            return result
+
+
+metrics = HostMetrics()
+
+def host_metrics():
+    return metrics.snapshot()
+
+
+def _limits():
+    return httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+
+def new_async_client(**kwargs):
+    # Async clients are bound to the loop they first run on, so each owner creates its own
+    return httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=_limits(), **kwargs)
+
+_sync_client = None
+_sync_client_lock = threading.Lock()
+
+def get_sync_client():
+    global _sync_client
+    with _sync_client_lock:
+        if _sync_client is None:
+            _sync_client = httpx.Client(timeout=HTTP_TIMEOUT, limits=_limits())
+        return _sync_client
+
+
+def _retry_delay(attempt, response=None):
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+    # Full jitter so clients that failed together don't retry together
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+def _should_retry(attempt, retries, response=None):
+    return attempt < retries and (response is None or response.status_code in RETRY_STATUSES)
+
+
+async def request_async(client, method, url, retries=HTTP_RETRIES, **kwargs):
+    """client.request with per-host latency metrics and jittered-backoff retries on
+    transport errors and 429/5xx gateway responses."""
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            metrics.record(url, time.perf_counter() - start, error=True)
+            if not _should_retry(attempt, retries):
+                raise
+            response = None
+        else:
+            metrics.record(url, time.perf_counter() - start, error=response.status_code >= 500)
+            if not _should_retry(attempt, retries, response):
+                return response
+        metrics.retried(url)
+        await asyncio.sleep(_retry_delay(attempt, response))
+        attempt += 1
+
+def request_sync(method, url, retries=HTTP_RETRIES, client=None, **kwargs):
+    client = client or get_sync_client()
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            response = client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            metrics.record(url, time.perf_counter() - start, error=True)
+            if not _should_retry(attempt, retries):
+                raise
+            response = None
+        else:
+            metrics.record(url, time.perf_counter() - start, error=response.status_code >= 500)
+            if not _should_retry(attempt, retries, response):
+                return response
+        metrics.retried(url)
+        time.sleep(_retry_delay(attempt, response))
+        attempt += 1
+
+
+class TokenError(Exception):
+    pass
+
+
+class OAuthTokenCache:
+    """Client-credentials token held until shortly before expires_in. Inside the refresh
+    margin the current token is still handed out while a single background refresh runs;
+    once it has expired, concurrent callers all wait on the same refresh."""
+
+    def __init__(self, client, token_url, headers, data, refresh_margin=OAUTH_REFRESH_MARGIN):
+        self.client = client
+        self.token_url = token_url
+        self.headers = headers
+        self.data = data
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._expires_at = 0.0
+        self._inflight = None
+        self.mints = 0
+
+    async def _mint(self):
+        response = await request_async(self.client, "POST", self.token_url, headers=self.headers, data=self.data)
+        if response.status_code != 200:
+            raise TokenError(f"Failed to generate token: {response.status_code}")
+        body = response.json()
+        self._token = body.get('access_token')
+        self._expires_at = time.monotonic() + float(body.get('expires_in', 3600))
+        self.mints += 1
+        return self._token
+
+    def _refresh(self):
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.ensure_future(self._mint())
+            self._inflight.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self._inflight
+
+    async def get(self):
+        remaining = self._expires_at - time.monotonic()
+        if self._token is not None and remaining > 0:
+            if remaining < self.refresh_margin:
+                self._refresh()
+            return self._token
+        # shield: one caller giving up must not cancel the refresh the others are waiting on
+        return await asyncio.shield(self._refresh())
+
+    def invalidate(self):
+        self._token = None
+        self._expires_at = 0.0
@@ -0,0 +1,294 @@
+import os
+import re
+import json
+import time
+import shutil
+import argparse
+import threading
+import numpy as np
+import yaml
+from logger_module import setup_logger
+
+logger = setup_logger()
+
+# Retrieval configurations from environment variables
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'azure')  # azure | local
+LOCAL_SEARCH_INDEX_DIR = os.getenv('LOCAL_SEARCH_INDEX_DIR', '.search_index')
+LOCAL_SEARCH_SOURCE_DIR = os.getenv('LOCAL_SEARCH_SOURCE_DIR')  # Build from this directory instead of the blob container
+LOCAL_SEARCH_RELOAD_SECONDS = float(os.getenv('LOCAL_SEARCH_RELOAD_SECONDS', '5'))
+LOCAL_SEARCH_DENSE_WEIGHT = float(os.getenv('LOCAL_SEARCH_DENSE_WEIGHT', '0.5'))
+
+FIELDS = ("name", "summary")
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+def tokenize(text):
+    tokens = []
+    for token in _TOKEN.findall((text or "").lower()):
+        # Light plural folding so "users" matches "USER"
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def _spec_summary(name, text):
+    try:
+        spec = yaml.load(text, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+    except yaml.YAMLError:
+        return text
+    if not isinstance(spec, dict) or 'paths' not in spec:
+        return text
+    parts = [spec.get('info', {}).get('title', name), spec.get('info', {}).get('description', '')]
+    for path, methods in spec['paths'].items():
+        for method, details in methods.items():
+            if isinstance(details, dict):
+                parts.append(f"{method.upper()} {path} {details.get('summary', '')} {details.get('description', '')}")
+    return "\n".join(part for part in parts if part)
+
+def documents_from_directory(directory):
+    documents = []
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        if not os.path.isfile(path):
+            continue
+        with open(path, 'r', encoding='utf-8', errors='replace') as file:
+            text = file.read()
+        if filename.endswith(('.yaml', '.yml')):
+            text = _spec_summary(filename, text)
+        documents.append({"name": filename, "summary": text})
+    return documents
+
+def documents_from_blobs(blob_service_client, container_name):
+    container = blob_service_client.get_container_client(container_name)
+    documents = []
+    for blob in container.list_blobs():
+        text = container.download_blob(blob.name).readall().decode('utf-8', errors='replace')
+        if blob.name.endswith(('.yaml', '.yml')):
+            text = _spec_summary(blob.name, text)
+        documents.append({"name": blob.name, "summary": text})
+    return documents
+
+def documents_from_catalog(catalog):
+    # One document per table: its name plus column names and comments
+    documents = []
+    for table in catalog.table_names():
+        columns = catalog.get_columns(table) or []
+        summary = " ".join([table] + [f"{c['name']} {c.get('comment') or ''}" for c in columns])
+        documents.append({"name": table, "summary": summary})
+    return documents
+
+
+def build_index(documents, index_dir=LOCAL_SEARCH_INDEX_DIR, embed_fn=None):
+    """Write a BM25 (+ optional dense) index as .npy arrays that are memory-mapped on load.
+    Each build goes to a fresh version directory and CURRENT is swapped atomically."""
+    version = f"{time.time_ns():020d}"
+    target = os.path.join(index_dir, version)
+    os.makedirs(target)
+
+    vocab = {}
+    for field in FIELDS:
+        postings = {}
+        doc_len = np.zeros(len(documents), dtype=np.float32)
+        for doc_id, document in enumerate(documents):
+            tokens = tokenize(document.get(field))
+            doc_len[doc_id] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, []).append((doc_id, count))
+
+        terms = sorted(postings)
+        vocab[field] = {term: term_id for term_id, term in enumerate(terms)}
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for term_id, term in enumerate(terms):
+            offsets[term_id + 1] = offsets[term_id] + len(postings[term])
+        doc_ids = np.fromiter((doc_id for term in terms for doc_id, _ in postings[term]), dtype=np.int32, count=int(offsets[-1]))
+        freqs = np.fromiter((count for term in terms for _, count in postings[term]), dtype=np.float32, count=int(offsets[-1]))
+        df = np.diff(offsets).astype(np.float32)
+        idf = np.log(1 + (len(documents) - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        np.save(os.path.join(target, f"{field}.offsets.npy"), offsets)
+        np.save(os.path.join(target, f"{field}.doc_ids.npy"), doc_ids)
+        np.save(os.path.join(target, f"{field}.freqs.npy"), freqs)
+        np.save(os.path.join(target, f"{field}.idf.npy"), idf)
+        np.save(os.path.join(target, f"{field}.doc_len.npy"), doc_len)
+
+    if embed_fn is not None:
+        vectors = np.asarray([embed_fn(f"{d['name']}\n{d.get('summary') or ''}") for d in documents], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        np.save(os.path.join(target, "vectors.npy"), vectors)
+
+    with open(os.path.join(target, "meta.json"), 'w') as file:
+        json.dump({"documents": documents, "vocab": vocab, "dense": embed_fn is not None}, file)
+
+    pointer = os.path.join(index_dir, "CURRENT")
+    with open(pointer + ".tmp", 'w') as file:
+        file.write(version)
+    os.replace(pointer + ".tmp", pointer)
+    logger.info(f"Built local search index {version} with {len(documents)} documents")
+
+    # Keep the previous version around for readers that still have it mapped
+    versions = sorted(name for name in os.listdir(index_dir) if os.path.isdir(os.path.join(index_dir, name)))
+    for old_version in versions[:-2]:
+        shutil.rmtree(os.path.join(index_dir, old_version), ignore_errors=True)
+    return target
+
+
+class _LoadedIndex:
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json"), 'r') as file:
+            meta = json.load(file)
+        self.documents = meta["documents"]
+        self.vocab = meta["vocab"]
+        self.arrays = {}
+        for field in FIELDS:
+            for name in ("offsets", "doc_ids", "freqs", "idf", "doc_len"):
+                self.arrays[field, name] = np.load(os.path.join(path, f"{field}.{name}.npy"), mmap_mode='r')
+        self.avg_len = {field: float(np.mean(self.arrays[field, "doc_len"])) if self.documents else 0.0 for field in FIELDS}
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode='r') if meta.get("dense") else None
+
+    def bm25(self, tokens, field):
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        offsets = self.arrays[field, "offsets"]
+        doc_len = self.arrays[field, "doc_len"]
+        avg_len = self.avg_len[field] or 1.0
+        for token in set(tokens):
+            term_id = self.vocab[field].get(token)
+            if term_id is None:
+                continue
+            start, end = offsets[term_id], offsets[term_id + 1]
+            doc_ids = self.arrays[field, "doc_ids"][start:end]
+            tf = self.arrays[field, "freqs"][start:end]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len[doc_ids] / avg_len)
+            scores[doc_ids] += self.arrays[field, "idf"][term_id] * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+
+class LocalSearchIndex:
+    """In-process stand-in for the Azure SearchClient: search() takes the same arguments and
+    yields dicts with the indexed fields. Reloads itself when a new index version is published."""
+
+    def __init__(self, index_dir=LOCAL_SEARCH_INDEX_DIR, embed_fn=None, dense_weight=LOCAL_SEARCH_DENSE_WEIGHT):
+        self.index_dir = index_dir
+        self.embed_fn = embed_fn
+        self.dense_weight = dense_weight
+        self._index = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._maybe_reload(force=True)
+
+    def _maybe_reload(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < LOCAL_SEARCH_RELOAD_SECONDS:
+            return
+        self._checked_at = now
+        try:
+            with open(os.path.join(self.index_dir, "CURRENT"), 'r') as file:
+                version = file.read().strip()
+        except FileNotFoundError:
+            return
+        if version == self._version:
+            return
+        with self._lock:
+            self._index = _LoadedIndex(os.path.join(self.index_dir, version))
+            self._version = version
+        logger.info(f"Loaded local search index {version}")
+
+    def search(self, search_text, search_fields=None, top=5, **kwargs):
+        self._maybe_reload()
+        index = self._index
+        if index is None or not index.documents:
+            return []
+        tokens = tokenize(search_text)
+        scores = np.zeros(len(index.documents), dtype=np.float32)
+        for field in (search_fields or FIELDS):
+            if field in FIELDS:
+                scores += index.bm25(tokens, field)
+
+        if index.vectors is not None and self.embed_fn is not None:
+            query = np.asarray(self.embed_fn(search_text), dtype=np.float32)
+            query /= max(float(np.linalg.norm(query)), 1e-12)
+            dense = index.vectors @ query
+            peak = float(scores.max())
+            scores = (1 - self.dense_weight) * (scores / peak if peak > 0 else scores) + self.dense_weight * dense
+
+        top = min(top, len(scores))
+        candidates = np.argpartition(-scores, top - 1)[:top]
+        ranked = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [dict(index.documents[doc_id], **{"@search.score": float(scores[doc_id])})
+                for doc_id in ranked if scores[doc_id] > 0]
+
+
+_search_backend = None
+_search_backend_lock = threading.Lock()
+
+def get_search_backend():
+    """The retrieval backend selected by SEARCH_BACKEND; Azure AI Search stays the default."""
+    global _search_backend
+    with _search_backend_lock:
+        if _search_backend is None:
+            if SEARCH_BACKEND == 'local':
+                _search_backend = LocalSearchIndex()
+            else:
+                from services import get_search_client
+                _search_backend = get_search_client()
+        return _search_backend
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+def compare_backends(queries, local, remote, search_fields, top=5):
+    """Recall@top of the local index against Azure AI Search results, plus latency of both."""
+    recalls, local_ms, remote_ms = [], [], []
+    for query in queries:
+        start = time.perf_counter()
+        expected = {r.get("name") for r in remote.search(search_text=query, search_fields=search_fields, top=top)}
+        remote_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        found = {r.get("name") for r in local.search(search_text=query, search_fields=search_fields, top=top)}
+        local_ms.append((time.perf_counter() - start) * 1000)
+        if expected:
+            recalls.append(len(expected & found) / len(expected))
+    return {
+        "queries": len(queries),
+        f"recall_at_{top}": float(np.mean(recalls)) if recalls else 0.0,
+        "local_ms": {"p50": _percentile(local_ms, 50), "p95": _percentile(local_ms, 95)},
+        "remote_ms": {"p50": _percentile(remote_ms, 50), "p95": _percentile(remote_ms, 95)},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or evaluate the local retrieval index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build")
+    build_parser.add_argument("--source-dir", default=LOCAL_SEARCH_SOURCE_DIR)
+    build_parser.add_argument("--with-catalog", action="store_true", help="Also index tables from the schema catalog")
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("queries", help="Text file with one question per line")
+    compare_parser.add_argument("--fields", default="name")
+    compare_parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if args.source_dir:
+            documents = documents_from_directory(args.source_dir)
+        else:
+            from services import get_blob_service_client, CONTAINER_NAME
+            documents = documents_from_blobs(get_blob_service_client(), CONTAINER_NAME)
+        if args.with_catalog:
+            from prompts import DB, SCHEMA
+            from schema_catalog import get_schema_catalog
+            documents += documents_from_catalog(get_schema_catalog(DB, SCHEMA))
+        build_index(documents)
+    else:
+        from services import get_search_client
+        with open(args.queries, 'r') as file:
+            queries = [line.strip() for line in file if line.strip()]
+        report = compare_backends(queries, LocalSearchIndex(), get_search_client(), args.fields.split(","), args.top)
+        print(json.dumps(report, indent=2))
@@ -1,51 +1,19 @@
-import yaml
 import json
-import base64
-import re
-import uuid
-import os
-import streamlit as st
-from azure.storage.blob import BlobServiceClient
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
-from azure.search.documents.indexes import SearchIndexClient
-from azure.search.documents.indexes.models import (
-    SearchIndex, SimpleField, SearchableField, SearchFieldDataType
-)
-from openai import AzureOpenAI
-from snowflake_utils import get_snowflake_connection
-from dotenv import load_dotenv
-
-#Establish OpenAI connection
-try:
-    client = AzureOpenAI(
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),  
-        api_version="2024-05-01-preview",
-        azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-        )
-except Exception as e:
-    st.error(f"Failed to establish OpenAI connection: {e}")
-
-deployment_name=os.getenv("DEPLOYMENT_NAME")  
-
-# Set your Azure Blob Storage and Search service credentials
-blob_service_client = BlobServiceClient.from_connection_string(os.getenv("BLOB_CONNECTION_STRING"))
-container_name = os.getenv("CONTAINER_NAME")
-
-# Define your Azure Search service endpoint and API key
-endpoint = os.getenv("AISEARCH_ENDPOINT")
-admin_key = os.getenv("AISEARCH_ADMIN_KEY")
-index_name = os.getenv("AISEARCH_INDEX_NAME")
-
-# Create a SearchClient instance
-credential = AzureKeyCredential(admin_key)
-search_client = SearchClient(endpoint=endpoint, index_name=index_name, credential=credential)
+from schema_catalog import get_schema_catalog
+from context_renderer import render_tables_context
+from local_search import get_search_backend
+from spec_registry import ApiSpec, get_spec_registry
+from llm_dispatch import get_llm_dispatcher
+from tracing import annotate
+from logger_module import setup_logger, SAMPLED
 
 DB = "CDL_LS"
 SCHEMA = "DAAS"
 
 SCHEMA_PATH = f"{DB}.{SCHEMA}"
 
+logger = setup_logger()
+
 def get_system_prompt():
     prompt = """
 You will be acting as an AI Expert named Conversational DaaS. 
@@ -55,34 +23,19 @@ Now to get started, just greet the end user.
     return prompt
     
 def tables_context(table_names):
-    conn = get_snowflake_connection()
-    cursor = conn.cursor()
+    # Column metadata is served from the in-memory schema catalog, no warehouse round trip
+    catalog = get_schema_catalog(DB, SCHEMA)
     properties = {}
-    table_summary =" "
     for table in table_names:
-        query = f""" DESCRIBE TABLE {DB}.{SCHEMA}.{table}"""
-        cursor.execute(query)
-        metadata = cursor.fetchall()
-        properties[table] = metadata
+        columns = catalog.get_columns(table)
+        if columns is None:
+            continue
+        properties[table] = columns
     tables_summary = properties
     return tables_summary
 
 def summarize_api_spec(api_spec,filename):
-    l = len(api_spec['servers'])
-    summary = f"**{api_spec['info']['title']}**:\n"
-    summary = f" Source file name:- {filename}**:\n"#
-    for i in range(l):
-        summary += f"  - URL: {api_spec['servers'][i]['url']}\n"
-    summary += "  - Endpoints:\n"
-    for path, methods in api_spec['paths'].items():
-        for method, details in methods.items():
-            summary += f"    - {method.upper()} {path}\n"
-            summary += f"      - Summary: {details['summary']}\n"
-            summary += f"      - Description: {details.get('description', 'No description')}\n"
-            summary += "      - Parameters:\n"
-            for param in details.get('parameters', []):
-                summary += f"        - {param['name']} ({param['in']} - {param['schema']['type']})\n"
-    return summary
+    return ApiSpec(filename, None, api_spec).summary
 
 GEN_API = """
 You will be generating REST API HTTP URLs based on user prompts and API Specifications provided to you.
@@ -98,7 +51,7 @@ Here are 7 critical rules for the interaction you must abide:
 2. Extract Information: Identify the relevant endpoint, method, and parameters from the provided YAML data.
 3. Match User Criteria: Ensure the generated URL includes the criteria specified by the user in their prompt.
 4. Construct the URL: Combine the base URL, endpoint, and parameters to construct the full URL.
-4. Make sure to generate a single REST API HTTP URL, not multiple.
+4. Generate one ```GET block per REST API HTTP URL. If answering needs several calls, give each call its own block in the order they run. A call that needs values from an earlier call's response refers to them as {{{{n.field}}}}, where n is the position of the earlier call starting at 1, e.g. {{{{1.id}}}}.
 5. Give answer to user prompt by fetching the answer from REST API HTTP URL generated by you.
 5. You should only use the API Specifications provided to you to answer user prompts, You MUST NOT hallucinate about the API Specifications.
 6. DO NOT put numerical at the very front of REST API HTTP URL.
@@ -113,24 +66,8 @@ def get_context(api_info):
     return context
 
 def api_context(api_names):
-    api_summaries = {}
-    directory = 'D:\Conversational DaaS\export_api'
-    # Iterate over each api_name
-    for api_name in api_names:
-        # Iterate over each filename in the directory
-        for filename in os.listdir(directory):
-            if api_name == filename:
-                if filename.endswith('.yaml') or filename.endswith('.yml'):
-                    file_path = os.path.join(directory, filename)
-                    with open(file_path, 'r') as file:
-                        api_spec = yaml.safe_load(file)
-                        api_summaries[filename] = summarize_api_spec(api_spec, filename)
-    #st.write(api_summaries)
-    context = get_context(api_summaries)
-    #st.write(context)
-    # context_api = extract_api_summary(context)
-    # st.write(context_api)
-    return context 
+    # Specs are parsed and summarised once by the registry, this is a lookup per name
+    return get_spec_registry().context(api_names)
 
 def get_api_prompt(api_names):
     apis = api_names
@@ -149,7 +86,7 @@ Here are 10 critical rules for the interaction you must abide:
 1. You MUST MUST wrap the generated sql code within ```sql code markdown in this format e.g
 ```sql
 ```
-2. Handle various SQL operations including SELECT, INSERT, UPDATE, DELETE, JOIN, aggregation, subqueries, and nested queries.
+2. Only generate read-only SELECT queries (JOIN, aggregation, subqueries and nested queries are fine). Never generate INSERT, UPDATE, DELETE, MERGE or DDL statements.
 3. Use the appropriate SQL clauses (SELECT, WHERE, JOIN, GROUP BY, HAVING, etc.) to construct the SQL query
 4. To retrieve information from more than one table, you need to join those tables together using JOIN methods. Use the following syntax:
 SELECT <list_of_column_names>
@@ -183,15 +120,20 @@ WHERE condition_column = 'condition_value';
 </rules>
     """
 
-def get_tables_prompt(table_names):
+def get_tables_prompt(table_names, user_prompt=""):
     tables = table_names
-    context_table = tables_context(tables)
+    context_table, stats = render_tables_context(tables_context(tables), user_prompt)
+    # Per request on the span; the log line is sampled
+    annotate(schema_context_tokens=stats['tokens'], tokens_saved=stats['tokens_saved'],
+             columns_kept=stats['columns_kept'], columns_total=stats['columns_total'])
+    logger.info(f"Schema context: {stats['tokens']} tokens, {stats['tokens_saved']} tokens saved, "
+                f"{stats['columns_kept']}/{stats['columns_total']} columns kept", extra=SAMPLED)
     return GEN_SQL.format(context=context_table)
 
 def extract_api_info_from_yaml_with_openai(api_specs,search_text):
     combined_summary = ""
-    for blob_name, api_spec in api_specs:
-        combined_summary += summarize_api_spec(api_spec,blob_name) + "\n"
+    for api_spec in api_specs:
+        combined_summary += api_spec.summary + "\n"
     try:
         #print(combined_summary) 
         # end     
@@ -211,8 +153,7 @@ def extract_api_info_from_yaml_with_openai(api_specs,search_text):
         User Input: {search_text}
         """    
         #print(prompt)
-        response = client.chat.completions.create(
-            model=deployment_name,
+        response = get_llm_dispatcher().complete(
             messages=[
                 {"role": "system", "content": combined_summary},
                 {"role": "user", "content": prompt}
@@ -221,23 +162,12 @@ def extract_api_info_from_yaml_with_openai(api_specs,search_text):
         extracted_info = response.choices[0].message.content
         return extracted_info
     except Exception as e:
-        st.error(f"Failed to extract API info with OpenAI: {str(e)}")
+        logger.error(f"Failed to extract API info with OpenAI: {str(e)}")
         return {'message': 'Failed to extract API info with OpenAI'}, 500
     
 def extract_and_index_api_spec_from_blobs(api_names,search_text):
-    #api_summaries = {}
-    api_specs = []
-    directory = 'D:\Conversational DaaS\export_api'
-    # Iterate over each api_name
-    for api_name in api_names:
-        # Iterate over each filename in the directory
-        for filename in os.listdir(directory):
-            if api_name == filename:
-                if filename.endswith('.yaml') or filename.endswith('.yml'):
-                    file_path = os.path.join(directory, filename)
-                    with open(file_path, 'r') as file:
-                        api_spec = yaml.safe_load(file)
-                        api_specs.append((api_name, api_spec))
+    registry = get_spec_registry()
+    api_specs = [spec for spec in (registry.get(api_name) for api_name in dict.fromkeys(api_names)) if spec is not None]
     extract_data = extract_api_info_from_yaml_with_openai(api_specs,search_text)
     extract_data = extract_data.strip()
     # Remove the triple backticks and `json` label
@@ -267,10 +197,10 @@ def perform_ai_search(user_input):
         #search_text = "list of Global Admins by account number and fetch account details for each listed Global Admin as well"  # Search query text
         # search_text=response.choices[0].message.content
         #print(search_text)
-        response = search_client.search(search_text=user_input, search_fields=search_fields, **select_options)
+        response = get_search_backend().search(search_text=user_input, search_fields=search_fields, **select_options)
         names = [result.get("name") for result in response if result.get("name")]
         #print(blob_names)
         return names, response
     except Exception as e:
-        st.error(f"Failed to search documents: {str(e)}")
+        logger.error(f"Failed to search documents: {str(e)}")
         return {'message': 'Failed to serve OpenAPI spec'}, 500
@@ -0,0 +1,265 @@
+import os
+import re
+import json
+import math
+import time
+import argparse
+import threading
+from collections import Counter
+from logger_module import setup_logger
+
+logger = setup_logger()
+
+# Query routing configurations from environment variables
+ROUTER_MODEL_PATH = os.getenv('ROUTER_MODEL_PATH', 'router_model.json')
+ROUTER_THRESHOLD = float(os.getenv('ROUTER_THRESHOLD', '0.6'))  # Less confident predictions fall back to the heuristic
+ROUTER_API_HITS = int(os.getenv('ROUTER_API_HITS', '3'))  # Heuristic: API mode once this many retrieved names are API specs
+ROUTER_MISROUTE_SECONDS = float(os.getenv('ROUTER_MISROUTE_SECONDS', '8'))  # A wasted generation plus a failed SQL/HTTP call
+
+ROUTES = ("db", "api", "hybrid")
+
+# TfidfVectorizer's default token pattern, so scoring sees the terms training did
+_TOKEN = re.compile(r"(?u)\b\w\w+\b")
+
+
+def is_api_spec(name):
+    return name.endswith('.yaml') or name.endswith('.yml')
+
+
+def router_text(prompt, name_list):
+    """The prompt plus what retrieval found, as pseudo-words, so one vocabulary covers both."""
+    api_hits = sum(1 for name in name_list if is_api_spec(name))
+    return f"{prompt} __api_hits_{api_hits} __db_hits_{len(name_list) - api_hits}"
+
+
+def heuristic_route(name_list):
+    api_hits = sum(1 for name in name_list if is_api_spec(name))
+    return "api" if api_hits >= ROUTER_API_HITS else "db"
+
+
+class Route:
+    __slots__ = ("route", "confidence", "source")
+
+    def __init__(self, route, confidence, source):
+        self.route = route
+        self.confidence = confidence
+        self.source = source  # model | heuristic
+
+
+class QueryRouter:
+    """DB / API / hybrid classifier: TF-IDF features and a multinomial logistic regression,
+    trained with scikit-learn and exported as plain weights. Scoring is a few dictionary
+    lookups, so it takes microseconds and needs neither scikit-learn nor numpy at runtime."""
+
+    def __init__(self, model, threshold=ROUTER_THRESHOLD):
+        self.model = model
+        self.classes = model["classes"]
+        self.intercept = model["intercept"]
+        self.terms = model["terms"]  # term -> [idf, weight for each class (one for binary models)]
+        self.ngram_max = model.get("ngram_max", 2)
+        self.threshold = threshold
+
+    def _features(self, text):
+        tokens = _TOKEN.findall(text.lower())
+        grams = Counter(tokens)
+        for n in range(2, self.ngram_max + 1):
+            grams.update(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        # Sublinear tf times idf, L2 normalized as TfidfVectorizer does
+        weights = {term: (1 + math.log(count)) * self.terms[term][0] for term, count in grams.items() if term in self.terms}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+        return {term: weight / norm for term, weight in weights.items()}
+
+    def predict(self, prompt, name_list=()):
+        """(route, probability) from the model alone."""
+        scores = list(self.intercept)
+        for term, weight in self._features(router_text(prompt, name_list)).items():
+            row = self.terms[term]
+            for i in range(len(scores)):
+                scores[i] += weight * row[i + 1]
+        if len(self.classes) == 2:
+            # Binary models carry one score, for the second class
+            positive = 1 / (1 + math.exp(-scores[0]))
+            probabilities = [1 - positive, positive]
+        else:
+            top = max(scores)
+            exps = [math.exp(score - top) for score in scores]
+            probabilities = [value / sum(exps) for value in exps]
+        best = max(range(len(probabilities)), key=probabilities.__getitem__)
+        return self.classes[best], probabilities[best]
+
+    def route(self, prompt, name_list=()):
+        label, confidence = self.predict(prompt, name_list)
+        if confidence < self.threshold:
+            return Route(heuristic_route(name_list), confidence, "heuristic")
+        return Route(label, confidence, "model")
+
+    def save(self, path=ROUTER_MODEL_PATH):
+        with open(path + ".tmp", 'w') as file:
+            json.dump(self.model, file)
+        os.replace(path + ".tmp", path)
+
+
+def train_router(samples, threshold=ROUTER_THRESHOLD, c=4.0):
+    """Fit a router on [{"question", "route", "retrieved": [names]}]; retrieved is optional."""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+
+    texts = [router_text(sample["question"], sample.get("retrieved") or []) for sample in samples]
+    labels = [sample["route"] for sample in samples]
+    vectorizer = TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True)
+    features = vectorizer.fit_transform(texts)
+    classifier = LogisticRegression(C=c, class_weight="balanced", max_iter=1000).fit(features, labels)
+    coef = classifier.coef_
+    terms = {term: [float(vectorizer.idf_[index])] + [float(value) for value in coef[:, index]]
+             for term, index in vectorizer.vocabulary_.items()}
+    model = {"classes": [str(label) for label in classifier.classes_],
+             "intercept": [float(value) for value in classifier.intercept_],
+             "terms": terms, "ngram_max": 2, "samples": len(samples)}
+    return QueryRouter(model, threshold)
+
+
+def load_router(path=ROUTER_MODEL_PATH, threshold=ROUTER_THRESHOLD):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as file:
+        return QueryRouter(json.load(file), threshold)
+
+
+_router = None
+_router_loaded = False
+_router_lock = threading.Lock()
+
+def get_query_router():
+    """The trained router from ROUTER_MODEL_PATH, or None when there is no model yet."""
+    global _router, _router_loaded
+    with _router_lock:
+        if not _router_loaded:
+            try:
+                _router = load_router()
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Router model {ROUTER_MODEL_PATH} not usable, using the retrieval heuristic: {str(e)}")
+            _router_loaded = True
+        return _router
+
+
+def route_query(prompt, name_list):
+    router = get_query_router()
+    route = router.route(prompt, name_list) if router else Route(heuristic_route(name_list), None, "heuristic")
+    # A mode needs something retrieved to build its context from
+    has_api = any(is_api_spec(name) for name in name_list)
+    has_db = any(not is_api_spec(name) for name in name_list)
+    if route.route != "db" and not has_api:
+        route.route = "db"
+    elif route.route == "hybrid" and not has_db:
+        route.route = "api"
+    return route
+
+
+def load_samples(path):
+    """Labelled questions, a JSON list or JSON lines of {"question", "route", "retrieved"?}."""
+    with open(path, 'r') as file:
+        text = file.read()
+    samples = json.loads(text) if text.lstrip().startswith('[') else [json.loads(line) for line in text.splitlines() if line.strip()]
+    unknown = {sample["route"] for sample in samples} - set(ROUTES)
+    if unknown:
+        raise ValueError(f"Unknown routes {sorted(unknown)}, expected {ROUTES}")
+    return samples
+
+
+def add_retrieval(samples, top=5):
+    # Samples without recorded hits get them from the configured search backend
+    from local_search import get_search_backend
+    search = get_search_backend()
+    for sample in samples:
+        if "retrieved" not in sample:
+            results = search.search(search_text=sample["question"], search_fields=["name"], top=top)
+            sample["retrieved"] = [result.get("name") for result in results if result.get("name")]
+    return samples
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+
+def evaluate(samples, folds=5, threshold=ROUTER_THRESHOLD, misroute_seconds=ROUTER_MISROUTE_SECONDS, seed=7):
+    """Cross-validated accuracy of the router against the retrieval heuristic, the router's own
+    latency, and the time its avoided misroutes would have cost."""
+    from sklearn.model_selection import StratifiedKFold
+
+    labels = [sample["route"] for sample in samples]
+    folds = max(2, min(folds, min(Counter(labels).values())))
+    predicted, model_only, heuristic, sources, latencies = [None] * len(samples), [None] * len(samples), [], [], []
+    for train_index, test_index in StratifiedKFold(folds, shuffle=True, random_state=seed).split(labels, labels):
+        router = train_router([samples[i] for i in train_index], threshold)
+        for i in test_index:
+            retrieved = samples[i].get("retrieved") or []
+            start = time.perf_counter()
+            route = router.route(samples[i]["question"], retrieved)
+            latencies.append((time.perf_counter() - start) * 1e6)
+            predicted[i] = route.route
+            sources.append(route.source)
+            model_only[i] = router.predict(samples[i]["question"], retrieved)[0]
+    heuristic = [heuristic_route(sample.get("retrieved") or []) for sample in samples]
+
+    def accuracy(routes):
+        return round(sum(route == label for route, label in zip(routes, labels)) / len(labels), 4)
+
+    per_route = {}
+    for route in sorted(set(labels)):
+        hits = sum(1 for p, label in zip(predicted, labels) if p == label == route)
+        chosen = sum(1 for p in predicted if p == route)
+        support = labels.count(route)
+        per_route[route] = {"precision": round(hits / chosen, 4) if chosen else 0.0,
+                            "recall": round(hits / support, 4), "support": support}
+    confusion = {label: dict(Counter(p for p, l in zip(predicted, labels) if l == label)) for label in sorted(set(labels))}
+    router_misroutes = sum(p != label for p, label in zip(predicted, labels))
+    heuristic_misroutes = sum(h != label for h, label in zip(heuristic, labels))
+    avoided = heuristic_misroutes - router_misroutes
+    return {
+        "samples": len(samples),
+        "folds": folds,
+        "threshold": threshold,
+        "router": {"accuracy": accuracy(predicted), "per_route": per_route, "confusion": confusion,
+                   "heuristic_fallback_rate": round(sources.count("heuristic") / len(sources), 4)},
+        "model_only_accuracy": accuracy(model_only),
+        "heuristic_accuracy": accuracy(heuristic),
+        "route_latency_us": {"p50": round(_percentile(latencies, 0.5), 1), "p99": round(_percentile(latencies, 0.99), 1)},
+        "misroutes": {"heuristic": heuristic_misroutes, "router": router_misroutes, "avoided": avoided},
+        "latency_saved_s": {"misroute_cost_s": misroute_seconds, "total": round(avoided * misroute_seconds, 2),
+                            "per_question": round(avoided * misroute_seconds / len(samples), 3)},
+    }
+
+
+def _misroute_seconds(benchmark_path):
+    # A misroute costs about one full request: the benchmark's median end-to-end time
+    with open(benchmark_path, 'r') as file:
+        report = json.load(file)
+    return report["runs"][0]["stages"]["total"]["p50_ms"] / 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train or evaluate the DB/API/hybrid query router")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train_parser = subparsers.add_parser("train")
+    train_parser.add_argument("samples", help="JSON or JSON lines of {question, route, retrieved?}")
+    train_parser.add_argument("--out", default=ROUTER_MODEL_PATH)
+    evaluate_parser = subparsers.add_parser("evaluate")
+    evaluate_parser.add_argument("samples", help="JSON or JSON lines of {question, route, retrieved?}")
+    evaluate_parser.add_argument("--folds", type=int, default=5)
+    evaluate_parser.add_argument("--threshold", type=float, default=ROUTER_THRESHOLD)
+    evaluate_parser.add_argument("--misroute-seconds", type=float, default=ROUTER_MISROUTE_SECONDS)
+    evaluate_parser.add_argument("--benchmark", help="benchmark.py report to take the misroute cost from")
+    for subparser in (train_parser, evaluate_parser):
+        subparser.add_argument("--retrieve", action="store_true", help="Fill missing retrieved names from the search backend")
+    args = parser.parse_args()
+
+    samples = load_samples(args.samples)
+    if args.retrieve:
+        samples = add_retrieval(samples)
+    if args.command == "train":
+        train_router(samples).save(args.out)
+        print(f"Router trained on {len(samples)} questions, written to {args.out}")
+    else:
+        misroute_seconds = _misroute_seconds(args.benchmark) if args.benchmark else args.misroute_seconds
+        print(json.dumps(evaluate(samples, args.folds, args.threshold, misroute_seconds), indent=2))
@@ -0,0 +1,106 @@
+import os
+import time
+import uuid
+import shutil
+import threading
+import pyarrow as pa
+import pyarrow.ipc as ipc
+from logger_module import setup_logger
+
+logger = setup_logger()
+
+# Chat result store configurations from environment variables
+RESULT_STORE_DIR = os.getenv('RESULT_STORE_DIR', '.result_store')
+RESULT_STORE_SESSION_BYTES = int(os.getenv('RESULT_STORE_SESSION_BYTES', str(512 * 1024 * 1024)))
+RESULT_STORE_TTL = int(os.getenv('RESULT_STORE_TTL', str(24 * 3600)))
+RESULT_PREVIEW_ROWS = int(os.getenv('RESULT_PREVIEW_ROWS', '20'))
+
+
+def _to_table(df):
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+        # Mixed-type object columns (typical of flattened API JSON) are stored as text
+        df = df.copy()
+        for column in df.columns[df.dtypes == object]:
+            df[column] = df[column].map(lambda value: value if value is None else str(value))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+class ResultStore:
+    """Chat results of one session kept as Arrow IPC files on disk instead of in session state.
+    Messages only hold a small preview and the result id; the full frame is memory-mapped back on
+    demand. The oldest results are dropped once the session is over max_bytes."""
+
+    def __init__(self, session_id=None, directory=RESULT_STORE_DIR, max_bytes=RESULT_STORE_SESSION_BYTES,
+                 preview_rows=RESULT_PREVIEW_ROWS):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.directory = os.path.join(directory, self.session_id)
+        self.max_bytes = max_bytes
+        self.preview_rows = preview_rows
+        self._files = {}  # result id -> size, oldest first
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        prune_sessions(directory)
+
+    def _path(self, result_id):
+        return os.path.join(self.directory, f"{result_id}.arrow")
+
+    def put(self, df):
+        result_id = uuid.uuid4().hex
+        path = self._path(result_id)
+        table = _to_table(df)
+        with pa.OSFile(path + ".tmp", "wb") as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(path + ".tmp", path)
+        with self._lock:
+            self._files[result_id] = os.path.getsize(path)
+            while sum(self._files.values()) > self.max_bytes and len(self._files) > 1:
+                oldest = next(iter(self._files))
+                del self._files[oldest]
+                try:
+                    os.remove(self._path(oldest))
+                except OSError:
+                    pass
+                logger.info(f"Result store over {self.max_bytes} bytes, dropped result {oldest}")
+        return result_id
+
+    def load(self, result_id):
+        """The full DataFrame, or None once the result has been dropped."""
+        if result_id not in self._files:
+            return None
+        try:
+            with pa.memory_map(self._path(result_id), "r") as source:
+                return ipc.open_file(source).read_all().to_pandas()
+        except (OSError, pa.ArrowInvalid):
+            return None
+
+    def stash(self, message):
+        """Replace a message's results DataFrame by its result id and a preview."""
+        if not hasattr(message.get("results"), "iloc"):
+            return message
+        df = message.pop("results")
+        message["result_id"] = self.put(df)
+        message["preview"] = df.head(self.preview_rows)
+        message["rows"] = len(df)
+        return message
+
+    def stats(self):
+        with self._lock:
+            return {"results": len(self._files), "bytes": sum(self._files.values())}
+
+
+def prune_sessions(directory=RESULT_STORE_DIR, ttl=RESULT_STORE_TTL):
+    # Abandoned sessions never clean up after themselves
+    cutoff = time.time() - ttl
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except OSError:
+            pass
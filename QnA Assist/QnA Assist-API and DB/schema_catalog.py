@@ -0,0 +1,203 @@
+import os
+import json
+import threading
+from snowflake_utils import snowflake_cursor
+from logger_module import setup_logger
+
+logger = setup_logger()
+
+# Schema catalog configurations from environment variables
+SCHEMA_CATALOG_DIR = os.getenv('SCHEMA_CATALOG_DIR', '.schema_catalog')
+SCHEMA_CATALOG_REFRESH_SECONDS = float(os.getenv('SCHEMA_CATALOG_REFRESH_SECONDS', '300'))
+
+COLUMNS_QUERY = """
+SELECT c.TABLE_NAME, c.COLUMN_NAME, c.DATA_TYPE, c.CHARACTER_MAXIMUM_LENGTH,
+       c.NUMERIC_PRECISION, c.NUMERIC_SCALE, c.IS_NULLABLE, c.COLUMN_DEFAULT,
+       c.COMMENT, t.LAST_ALTERED
+FROM {db}.INFORMATION_SCHEMA.COLUMNS c
+JOIN {db}.INFORMATION_SCHEMA.TABLES t
+  ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+WHERE c.TABLE_SCHEMA = %s {table_filter}
+ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
+"""
+
+TABLES_QUERY = """
+SELECT TABLE_NAME, LAST_ALTERED
+FROM {db}.INFORMATION_SCHEMA.TABLES
+WHERE TABLE_SCHEMA = %s
+"""
+
+def _column_type(data_type, char_length, precision, scale):
+    if data_type == 'TEXT' and char_length:
+        return f"VARCHAR({char_length})"
+    if data_type == 'NUMBER' and precision is not None:
+        return f"NUMBER({precision},{scale or 0})"
+    return data_type
+
+def describe_columns(rows):
+    """DESCRIBE TABLE rows (name, type, kind, null?, default, ..., comment at 9) as catalog column dicts."""
+    return [{
+        "name": row[0],
+        "type": row[1],
+        "nullable": row[3] == 'Y',
+        "default": row[4],
+        "comment": row[9] if len(row) > 9 else None,
+    } for row in rows]
+
+
+class SchemaCatalog:
+    """In-memory column metadata for one schema, bulk loaded from INFORMATION_SCHEMA,
+    persisted as a JSON snapshot and refreshed incrementally by LAST_ALTERED."""
+
+    def __init__(self, database, schema, snapshot_path=None,
+                 refresh_seconds=SCHEMA_CATALOG_REFRESH_SECONDS):
+        self.database = database
+        self.schema = schema
+        self.snapshot_path = snapshot_path or os.path.join(SCHEMA_CATALOG_DIR, f"{database}.{schema}.json")
+        self.refresh_seconds = refresh_seconds
+        # {TABLE_NAME: {"last_altered": str, "columns": [{name, type, nullable, default, comment}]}}
+        self._tables = {}
+        self._lock = threading.Lock()
+        self.ready = threading.Event()  # Set once start() has loaded, or failed with start_error
+        self.start_error = None
+        self._refresh_requested = threading.Event()
+        self._refresher = None
+
+    def _query(self, query, params):
+        with snowflake_cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+    def _load_columns(self, table_names=None):
+        table_filter = ""
+        params = [self.schema]
+        if table_names:
+            table_filter = "AND c.TABLE_NAME IN (" + ", ".join(["%s"] * len(table_names)) + ")"
+            params.extend(table_names)
+        rows = self._query(COLUMNS_QUERY.format(db=self.database, table_filter=table_filter), params)
+        tables = {}
+        for table, column, data_type, char_length, precision, scale, nullable, default, comment, last_altered in rows:
+            entry = tables.setdefault(table, {"last_altered": str(last_altered), "columns": []})
+            entry["columns"].append({
+                "name": column,
+                "type": _column_type(data_type, char_length, precision, scale),
+                "nullable": nullable == 'YES',
+                "default": default,
+                "comment": comment,
+            })
+        return tables
+
+    def full_load(self):
+        tables = self._load_columns()
+        with self._lock:
+            self._tables = tables
+        logger.info(f"Schema catalog loaded {len(tables)} tables from {self.database}.{self.schema}")
+        self.save_snapshot()
+
+    def refresh(self):
+        # Only tables whose LAST_ALTERED moved (or that are new) have their columns reloaded
+        current = {table: str(last_altered) for table, last_altered in
+                   self._query(TABLES_QUERY.format(db=self.database), [self.schema])}
+        with self._lock:
+            known = self._tables
+        changed = [table for table, last_altered in current.items()
+                   if table not in known or known[table]["last_altered"] != last_altered]
+        dropped = [table for table in known if table not in current]
+        if not changed and not dropped:
+            return
+        reloaded = self._load_columns(changed) if changed else {}
+        with self._lock:
+            tables = {table: entry for table, entry in self._tables.items() if table in current}
+            tables.update(reloaded)
+            self._tables = tables
+        logger.info(f"Schema catalog refreshed: {len(changed)} changed, {len(dropped)} dropped tables")
+        self.save_snapshot()
+
+    def load_snapshot(self):
+        try:
+            with open(self.snapshot_path, 'r') as file:
+                snapshot = json.load(file)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.info(f"Ignoring unreadable schema catalog snapshot: {str(e)}")
+            return False
+        if snapshot.get("database") != self.database or snapshot.get("schema") != self.schema:
+            return False
+        with self._lock:
+            self._tables = snapshot["tables"]
+        return True
+
+    def save_snapshot(self):
+        with self._lock:
+            snapshot = {"database": self.database, "schema": self.schema, "tables": self._tables}
+        tmp_path = self.snapshot_path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or '.', exist_ok=True)
+            with open(tmp_path, 'w') as file:
+                json.dump(snapshot, file)
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            logger.info(f"Failed to write schema catalog snapshot: {str(e)}")
+
+    def get_columns(self, table):
+        entry = self._tables.get(str(table).strip().upper())
+        if entry is None:
+            # Unknown table: pick it up on the next background refresh instead of blocking the prompt
+            self._refresh_requested.set()
+            return None
+        return entry["columns"]
+
+    def table_names(self):
+        return list(self._tables)
+
+    def _refresh_loop(self):
+        while True:
+            self._refresh_requested.wait(self.refresh_seconds)
+            self._refresh_requested.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.info(f"Schema catalog refresh failed: {str(e)}")
+
+    def start(self):
+        # Warm start from the snapshot when possible, otherwise one bulk query
+        try:
+            if self.load_snapshot():
+                self._refresh_requested.set()
+            else:
+                self.full_load()
+        except BaseException as e:
+            self.start_error = e
+            raise
+        finally:
+            self.ready.set()
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, name="SchemaCatalogRefresh", daemon=True)
+            self._refresher.start()
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def get_schema_catalog(database, schema):
+    key = (database.upper(), schema.upper())
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        loader = catalog is None
+        if loader:
+            catalog = _catalogs[key] = SchemaCatalog(*key)
+    # The first load runs outside the lock: other schemas don't wait on it, callers for this one do
+    if loader:
+        try:
+            catalog.start()
+        except BaseException:
+            with _catalogs_lock:
+                # The next caller tries again
+                if _catalogs.get(key) is catalog:
+                    del _catalogs[key]
+            raise
+    catalog.ready.wait()
+    if catalog.start_error is not None:
+        raise catalog.start_error
+    return catalog
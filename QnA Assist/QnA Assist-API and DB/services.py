@@ -0,0 +1,65 @@
+import os
+import time
+import functools
+import threading
+from dotenv import load_dotenv
+from logger_module import setup_logger
+
+# Load environment variables from .env file if present
+load_dotenv()
+
+logger = setup_logger()
+
+# Azure service configurations from environment variables
+AZURE_OPENAI_API_VERSION = os.getenv('AZURE_OPENAI_API_VERSION', '2024-05-01-preview')
+DEPLOYMENT_NAME = os.getenv("DEPLOYMENT_NAME")
+CONTAINER_NAME = os.getenv("CONTAINER_NAME")
+
+_services = {}
+_build_seconds = {}
+_services_lock = threading.RLock()
+
+
+def lazy_service(factory):
+    """Turn a zero-argument factory into a getter for one process-wide instance, built (and its
+    heavy imports paid for) on first use rather than at import. Module state outlives Streamlit
+    reruns, so every rerun and every module shares the same client."""
+    name = factory.__name__
+
+    @functools.wraps(factory)
+    def get():
+        try:
+            return _services[name]
+        except KeyError:
+            pass
+        # Reentrant: a factory may use other services
+        with _services_lock:
+            if name not in _services:
+                started = time.perf_counter()
+                _services[name] = factory()
+                _build_seconds[name] = round(time.perf_counter() - started, 4)
+                logger.info(f"Built service {name} in {_build_seconds[name]}s")
+            return _services[name]
+
+    get.is_built = lambda: name in _services
+    return get
+
+
+@lazy_service
+def get_blob_service_client():
+    from azure.storage.blob import BlobServiceClient
+    return BlobServiceClient.from_connection_string(os.getenv("BLOB_CONNECTION_STRING"))
+
+
+@lazy_service
+def get_search_client():
+    from azure.core.credentials import AzureKeyCredential
+    from azure.search.documents import SearchClient
+    return SearchClient(endpoint=os.getenv("AISEARCH_ENDPOINT"), index_name=os.getenv("AISEARCH_INDEX_NAME"),
+                        credential=AzureKeyCredential(os.getenv("AISEARCH_ADMIN_KEY")))
+
+
+def service_stats():
+    """Seconds each service took to build; services never used are absent."""
+    with _services_lock:
+        return dict(_build_seconds)
@@ -0,0 +1,154 @@
+import os
+import time
+import threading
+import yaml
+from logger_module import setup_logger
+
+logger = setup_logger()
+
+# Spec registry configurations from environment variables
+API_SPEC_SOURCE = os.getenv('API_SPEC_SOURCE', 'directory')  # directory | blob
+API_SPEC_DIR = os.getenv('API_SPEC_DIR', r'D:\Conversational DaaS\export_api')
+API_SPEC_REFRESH_SECONDS = float(os.getenv('API_SPEC_REFRESH_SECONDS', '60'))
+
+# libyaml's C loader when available, it parses large specs several times faster
+_Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+def is_spec_file(name):
+    return name.endswith('.yaml') or name.endswith('.yml')
+
+
+class Endpoint:
+    __slots__ = ("method", "path", "summary", "description", "parameters", "text")
+
+    def __init__(self, method, path, details):
+        self.method = method.upper()
+        self.path = path
+        self.summary = details['summary']
+        self.description = details.get('description', 'No description')
+        self.parameters = tuple((param['name'], param['in'], param['schema']['type']) for param in details.get('parameters', []))
+        text = f"    - {self.method} {path}\n"
+        text += f"      - Summary: {self.summary}\n"
+        text += f"      - Description: {self.description}\n"
+        text += "      - Parameters:\n"
+        for name, location, param_type in self.parameters:
+            text += f"        - {name} ({location} - {param_type})\n"
+        self.text = text
+
+
+class ApiSpec:
+    __slots__ = ("filename", "version", "spec", "servers", "endpoints", "summary")
+
+    def __init__(self, filename, version, spec):
+        self.filename = filename
+        self.version = version
+        self.spec = spec
+        self.servers = tuple(server['url'] for server in spec['servers'])
+        # Indexed by (path, METHOD)
+        self.endpoints = {}
+        for path, methods in spec['paths'].items():
+            for method, details in methods.items():
+                endpoint = Endpoint(method, path, details)
+                self.endpoints[(path, endpoint.method)] = endpoint
+        summary = f" Source file name:- {filename}**:\n"
+        for url in self.servers:
+            summary += f"  - URL: {url}\n"
+        summary += "  - Endpoints:\n"
+        summary += "".join(endpoint.text for endpoint in self.endpoints.values())
+        self.summary = summary
+
+
+class DirectorySource:
+    def __init__(self, directory=API_SPEC_DIR):
+        self.directory = directory
+
+    def versions(self):
+        versions = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and is_spec_file(entry.name):
+                    versions[entry.name] = entry.stat().st_mtime_ns
+        return versions
+
+    def read(self, name):
+        with open(os.path.join(self.directory, name), 'rb') as file:
+            return file.read()
+
+
+class BlobSource:
+    def __init__(self, blob_service_client, container_name):
+        self.container = blob_service_client.get_container_client(container_name)
+
+    def versions(self):
+        return {blob.name: blob.etag for blob in self.container.list_blobs() if is_spec_file(blob.name)}
+
+    def read(self, name):
+        return self.container.download_blob(name).readall()
+
+
+class SpecRegistry:
+    """All API specs parsed once and summarised per endpoint. The source is re-listed at most
+    every refresh_seconds and only files whose mtime/ETag changed are parsed again."""
+
+    def __init__(self, source, refresh_seconds=API_SPEC_REFRESH_SECONDS):
+        self.source = source
+        self.refresh_seconds = refresh_seconds
+        self._specs = {}
+        self._listed_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self._listed_at is not None and now - self._listed_at < self.refresh_seconds:
+            return
+        with self._lock:
+            if not force and self._listed_at is not None and now - self._listed_at < self.refresh_seconds:
+                return
+            versions = self.source.versions()
+            specs = {name: spec for name, spec in self._specs.items() if name in versions}
+            reloaded = 0
+            for name, version in versions.items():
+                if name in specs and specs[name].version == version:
+                    continue
+                try:
+                    specs[name] = ApiSpec(name, version, yaml.load(self.source.read(name), Loader=_Loader))
+                    reloaded += 1
+                except Exception as e:
+                    logger.info(f"Skipping API spec {name}: {str(e)}")
+            self._specs = specs
+            self._listed_at = now
+        if reloaded:
+            logger.info(f"API spec registry loaded {reloaded} specs, {len(specs)} total")
+
+    def get(self, filename):
+        self.refresh()
+        return self._specs.get(filename)
+
+    def endpoint(self, filename, path, method):
+        spec = self.get(filename)
+        return spec.endpoints.get((path, method.upper())) if spec else None
+
+    def context(self, filenames):
+        self.refresh()
+        context = " "
+        for filename in dict.fromkeys(filenames):
+            spec = self._specs.get(filename)
+            if spec is not None:
+                context += spec.summary + "\n"
+        return context
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_spec_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            if API_SPEC_SOURCE == 'blob':
+                from services import get_blob_service_client, CONTAINER_NAME
+                source = BlobSource(get_blob_service_client(), CONTAINER_NAME)
+            else:
+                source = DirectorySource()
+            _registry = SpecRegistry(source)
+        return _registry
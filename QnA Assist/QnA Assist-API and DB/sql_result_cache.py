@@ -0,0 +1,291 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import Counter
+import pandas as pd
+import sqlglot
+from sqlglot import exp
+from sqlglot.optimizer.normalize_identifiers import normalize_identifiers
+from logger_module import setup_logger
+
+logger = setup_logger()
+
+# SQL result cache configurations from environment variables
+SQL_RESULT_CACHE = os.getenv('SQL_RESULT_CACHE', 'true').lower() == 'true'
+SQL_RESULT_CACHE_DIR = os.getenv('SQL_RESULT_CACHE_DIR', '.sql_result_cache')
+SQL_RESULT_CACHE_MAX_BYTES = int(os.getenv('SQL_RESULT_CACHE_MAX_BYTES', str(1024 * 1024 * 1024)))
+SQL_RESULT_CACHE_CHECK_SECONDS = float(os.getenv('SQL_RESULT_CACHE_CHECK_SECONDS', '30'))  # LAST_ALTERED lookups are reused this long
+SQL_RESULT_SCAN_TTL = float(os.getenv('SQL_RESULT_SCAN_TTL', str(23 * 3600)))  # Snowflake keeps query results for 24h
+SQL_RESULT_CACHE_MAX_AGE = float(os.getenv('SQL_RESULT_CACHE_MAX_AGE', '3600'))  # Local copies are dropped after this long
+
+LAST_ALTERED_QUERY = """
+SELECT TABLE_NAME, TABLE_TYPE, LAST_ALTERED
+FROM {db}.INFORMATION_SCHEMA.TABLES
+WHERE TABLE_SCHEMA = %s AND TABLE_NAME IN ({names})
+"""
+
+# Functions whose value depends on when or by whom the query runs, not on the tables
+VOLATILE_FUNCTIONS = {"RAND", "RANDOM", "RANDSTR", "UUID", "UUID_STRING", "UNIFORM", "NORMAL", "ZIPF",
+                      "SEQ1", "SEQ2", "SEQ4", "SEQ8", "GETDATE", "SYSDATE", "SYSTIMESTAMP", "NOW",
+                      "LOCALTIME", "LOCALTIMESTAMP", "GETVARIABLE", "LAST_QUERY_ID", "LAST_TRANSACTION"}
+
+
+def canonicalize(sql):
+    """Parsed statement with identifier case, table aliases and formatting normalized, so the
+    same query written differently by the model gets the same fingerprint."""
+    statement = normalize_identifiers(sqlglot.parse_one(sql, read="snowflake"), dialect="snowflake")
+    tables = list(statement.find_all(exp.Table))
+    counts = Counter(table.alias for table in tables if table.alias)
+    # Aliases are renamed by position; ones reused in several scopes are left alone
+    aliases = {}
+    for position, table in enumerate(tables, start=1):
+        if table.alias and counts[table.alias] == 1:
+            aliases[table.alias] = f"_T{position}"
+            table.set("alias", exp.TableAlias(this=exp.to_identifier(aliases[table.alias])))
+    for column in statement.find_all(exp.Column):
+        if column.table in aliases:
+            column.set("table", exp.to_identifier(aliases[column.table]))
+    return statement
+
+
+def is_volatile(statement):
+    for function in statement.find_all(exp.Func):
+        name = (function.name if isinstance(function, exp.Anonymous) else function.sql_name()).upper()
+        if name in VOLATILE_FUNCTIONS or name.startswith("CURRENT_"):
+            return True
+    return False
+
+
+def referenced_tables(statement, database, schema):
+    ctes = {cte.alias for cte in statement.find_all(exp.CTE)}
+    names = set()
+    for table in statement.find_all(exp.Table):
+        if table.name and table.name not in ctes:
+            names.add((table.catalog or database, table.db or schema, table.name))
+    return sorted(names)
+
+
+class CacheLookup:
+    __slots__ = ("fingerprint", "tables", "state", "frame", "query_id")
+
+    def __init__(self, fingerprint, tables, state, frame=None, query_id=None):
+        self.fingerprint = fingerprint
+        self.tables = tables
+        self.state = state  # {"DB.SCHEMA.TABLE": LAST_ALTERED} as of the lookup; None when unknown
+        self.frame = frame  # Local copy, when still valid
+        self.query_id = query_id  # Query whose persisted result can be RESULT_SCANned instead
+
+
+class SqlResultCache:
+    """Results of generated SQL keyed on the canonical SQL fingerprint, stored as Parquet with
+    the LAST_ALTERED of every referenced table. An entry is valid until one of those tables
+    changes; queries without base tables, on views or using volatile functions (CURRENT_DATE,
+    RANDOM...) are never cached, and local copies older than max_age are dropped. Local copies are evicted oldest-first over max_bytes; an evicted entry still
+    remembers its Snowflake query id, whose persisted result is read back with RESULT_SCAN
+    instead of running the query again."""
+
+    def __init__(self, database, schema, directory=SQL_RESULT_CACHE_DIR, max_bytes=SQL_RESULT_CACHE_MAX_BYTES,
+                 check_seconds=SQL_RESULT_CACHE_CHECK_SECONDS, scan_ttl=SQL_RESULT_SCAN_TTL,
+                 max_age=SQL_RESULT_CACHE_MAX_AGE):
+        self.database = database.upper()
+        self.schema = schema.upper()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.check_seconds = check_seconds
+        self.scan_ttl = scan_ttl
+        self.max_age = max_age
+        self._entries = {}  # fingerprint -> metadata, least recently used first
+        self._last_altered = {}  # "DB.SCHEMA.TABLE" -> (checked at, LAST_ALTERED)
+        self._lock = threading.Lock()
+        self._counters = {"local_hits": 0, "result_scan_hits": 0, "misses": 0, "invalidations": 0,
+                          "stores": 0, "evictions": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, fingerprint, suffix):
+        return os.path.join(self.directory, f"{fingerprint}.{suffix}")
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'r') as file:
+                    entries.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+        for meta in sorted(entries, key=lambda meta: meta.get("used", 0)):
+            self._entries[meta["fingerprint"]] = meta
+
+    def _table_state(self, cursor, tables):
+        """LAST_ALTERED of each table, re-read from INFORMATION_SCHEMA at most every check_seconds."""
+        now = time.time()
+        state, stale = {}, {}
+        for database, schema, table in tables:
+            name = f"{database}.{schema}.{table}"
+            checked = self._last_altered.get(name)
+            if checked is not None and now - checked[0] < self.check_seconds:
+                state[name] = checked[1]
+            else:
+                stale.setdefault((database, schema), []).append(table)
+        for (database, schema), names in stale.items():
+            cursor.execute(LAST_ALTERED_QUERY.format(db=database, names=", ".join(["%s"] * len(names))),
+                           [schema] + names)
+            # A view's LAST_ALTERED doesn't move when its base tables change
+            found = {table: str(last_altered) for table, table_type, last_altered in cursor.fetchall()
+                     if table_type == "BASE TABLE"}
+            for table in names:
+                name = f"{database}.{schema}.{table}"
+                # A view, or unknown to INFORMATION_SCHEMA (a function, a table of another role...): never cached
+                state[name] = found.get(table)
+                self._last_altered[name] = (now, state[name])
+        return state
+
+    def lookup(self, cursor, sql):
+        """A CacheLookup for sql, or None when it can't be fingerprinted. cursor is only used
+        for the LAST_ALTERED check."""
+        try:
+            statement = canonicalize(sql)
+        except sqlglot.errors.SqlglotError:
+            return None
+        fingerprint = hashlib.sha256(statement.sql(dialect="snowflake").encode()).hexdigest()
+        tables = referenced_tables(statement, self.database, self.schema)
+        # Nothing to invalidate on: a table-less or volatile result would be served stale forever
+        state = self._table_state(cursor, tables) if tables and not is_volatile(statement) else None
+        if state is not None and any(value is None for value in state.values()):
+            state = None
+        lookup = CacheLookup(fingerprint, tables, state)
+
+        with self._lock:
+            meta = self._entries.get(fingerprint)
+        if meta is None or state is None:
+            self._count("misses")
+            return lookup
+        if meta["tables"] != state:
+            logger.info(f"SQL result cache entry {fingerprint[:12]} invalidated, referenced tables changed")
+            self._drop(fingerprint)
+            self._count("invalidations")
+            self._count("misses")
+            return lookup
+
+        with self._lock:
+            meta["used"] = time.time()
+            self._entries.pop(fingerprint, None)
+            self._entries[fingerprint] = meta
+        if meta.get("bytes") and time.time() - meta["created"] >= self.max_age:
+            self._drop_copy(meta)
+        if meta.get("bytes"):
+            try:
+                lookup.frame = pd.read_parquet(self._path(fingerprint, "parquet"))
+                lookup.frame.attrs["truncated"] = meta["truncated"]
+                self._count("local_hits")
+                return lookup
+            except (OSError, ValueError) as e:
+                logger.info(f"SQL result cache copy {fingerprint[:12]} unreadable: {str(e)}")
+        if meta.get("query_id") and time.time() - meta["created"] < self.scan_ttl:
+            lookup.query_id = meta["query_id"]
+            self._count("result_scan_hits")
+            return lookup
+        self._count("misses")
+        return lookup
+
+    def store(self, lookup, df, query_id=None):
+        """Record df as the result of the looked-up SQL, computed after lookup.state was read."""
+        if lookup is None or lookup.state is None:
+            return
+        fingerprint = lookup.fingerprint
+        meta = {"fingerprint": fingerprint, "tables": lookup.state, "query_id": query_id, "created": time.time(),
+                "used": time.time(), "rows": len(df), "truncated": bool(df.attrs.get("truncated", False)), "bytes": 0}
+        path = self._path(fingerprint, "parquet")
+        try:
+            df.to_parquet(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+            meta["bytes"] = os.path.getsize(path)
+        except Exception as e:
+            # Columns Parquet can't hold: the query id still allows a RESULT_SCAN
+            logger.info(f"SQL result cache could not store {fingerprint[:12]} locally: {str(e)}")
+        self._write_meta(meta)
+        with self._lock:
+            self._entries.pop(fingerprint, None)
+            self._entries[fingerprint] = meta
+        self._count("stores")
+        self._evict()
+
+    def _write_meta(self, meta):
+        path = self._path(meta["fingerprint"], "json")
+        with open(path + ".tmp", 'w') as file:
+            json.dump(meta, file)
+        os.replace(path + ".tmp", path)
+
+    def _evict(self):
+        # Oldest local copies go first; their metadata stays for RESULT_SCAN until scan_ttl
+        now = time.time()
+        evicted, expired = [], []
+        with self._lock:
+            total = sum(meta["bytes"] for meta in self._entries.values())
+            for fingerprint, meta in list(self._entries.items()):
+                if not meta["bytes"] and now - meta["created"] >= self.scan_ttl:
+                    expired.append(fingerprint)
+                elif total > self.max_bytes and meta["bytes"]:
+                    total -= meta["bytes"]
+                    meta["bytes"] = 0
+                    evicted.append(meta)
+        for meta in evicted:
+            self._remove(self._path(meta["fingerprint"], "parquet"))
+            self._write_meta(meta)
+            self._count("evictions")
+        for fingerprint in expired:
+            self._drop(fingerprint)
+
+    def _drop_copy(self, meta):
+        # Past max_age: the query id can still be RESULT_SCANned while the tables are unchanged
+        with self._lock:
+            meta["bytes"] = 0
+        self._remove(self._path(meta["fingerprint"], "parquet"))
+        self._write_meta(meta)
+
+    def _drop(self, fingerprint):
+        with self._lock:
+            self._entries.pop(fingerprint, None)
+        self._remove(self._path(fingerprint, "parquet"))
+        self._remove(self._path(fingerprint, "json"))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            counters["entries"] = len(self._entries)
+            counters["local_bytes"] = sum(meta["bytes"] for meta in self._entries.values())
+        counters["warehouse_queries_saved"] = counters["local_hits"] + counters["result_scan_hits"]
+        return counters
+
+
+def result_scan_sql(query_id):
+    return f"SELECT * FROM TABLE(RESULT_SCAN('{query_id}'))"
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_sql_result_cache(database, schema):
+    """The process-wide cache for a default database/schema, or None when SQL_RESULT_CACHE is off."""
+    if not SQL_RESULT_CACHE:
+        return None
+    key = (database.upper(), schema.upper())
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = SqlResultCache(*key)
+        return _caches[key]
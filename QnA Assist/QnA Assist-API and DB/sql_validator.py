@@ -0,0 +1,136 @@
+import difflib
+import threading
+from sqlglot import exp
+from sqlglot.optimizer.scope import traverse_scope
+from sql_guard import SqlGuardError, parse_select
+from logger_module import setup_logger
+
+logger = setup_logger()
+
+REPAIR_PROMPT = """
+The query above was checked against the schema before running it and was rejected:
+{error}
+Reply with the corrected query in a single ```sql block, using only tables and columns from the context.
+"""
+
+_metrics = {"checked": 0, "rejected": 0, "repaired": 0, "repair_failed": 0}
+_metrics_lock = threading.Lock()
+
+
+class SqlValidationError(SqlGuardError):
+    pass
+
+
+def count(name):
+    with _metrics_lock:
+        _metrics[name] += 1
+
+
+def validation_stats():
+    with _metrics_lock:
+        stats = dict(_metrics)
+    # Every rejected query would have failed in Snowflake after at least one round trip
+    stats["warehouse_round_trips_avoided"] = stats["rejected"]
+    return stats
+
+
+def _suggest(name, candidates):
+    matches = difflib.get_close_matches(name, candidates, n=3, cutoff=0.6)
+    return f" (did you mean {', '.join(matches)}?)" if matches else ""
+
+
+class _Resolver:
+    """Columns of each source visible from a scope: a set for catalog tables, None for sources
+    that can't be checked (CTEs, subqueries, table functions, other schemas)."""
+
+    def __init__(self, catalog, database, schema):
+        self.catalog = catalog
+        self.database = database.upper()
+        self.schema = schema.upper()
+        self.known = set(catalog.table_names())
+        self.problems = []
+
+    def _in_schema(self, table):
+        return ((not table.catalog or table.catalog.upper() == self.database)
+                and (not table.db or table.db.upper() == self.schema))
+
+    def sources(self, scope):
+        resolved = {}
+        for name, source in scope.sources.items():
+            columns = None
+            if isinstance(source, exp.Table) and isinstance(source.this, exp.Identifier) and self._in_schema(source):
+                table = source.name.upper()
+                if table not in self.known:
+                    problem = f"Table {table} does not exist in {self.database}.{self.schema}{_suggest(table, self.known)}."
+                    if problem not in self.problems:
+                        self.problems.append(problem)
+                else:
+                    columns = {column["name"].upper() for column in self.catalog.get_columns(table) or []}
+            resolved[name.upper()] = (source.name.upper() if isinstance(source, exp.Table) else name.upper(), columns)
+        return resolved
+
+
+def validate_sql(sql, catalog, database, schema):
+    """Resolve every table and column of sql against the in-memory schema catalog, without the
+    warehouse. Raises SqlValidationError listing each one that doesn't exist. Only what the
+    catalog can vouch for is checked, so valid SQL is never rejected for using CTEs, subqueries,
+    table functions or other schemas."""
+    count("checked")
+    try:
+        statement = parse_select(sql)
+    except SqlGuardError as e:
+        count("rejected")
+        raise SqlValidationError(str(e))
+    resolver = _Resolver(catalog, database, schema)
+    if not resolver.known:
+        # Catalog not loaded, nothing to check against
+        return
+
+    scopes = {}
+    for scope in traverse_scope(statement):
+        scopes[id(scope.expression)] = scope
+    resolved = {}
+
+    def visible(scope):
+        # The scope's own sources first, then those of enclosing scopes (correlated references)
+        chain = []
+        while scope is not None:
+            if id(scope) not in resolved:
+                resolved[id(scope)] = resolver.sources(scope)
+            chain.append(resolved[id(scope)])
+            scope = scope.parent
+        return chain
+
+    # Every table is resolved, including those of scopes without a column (SELECT COUNT(*), SELECT *)
+    for scope in scopes.values():
+        visible(scope)
+
+    for column in statement.find_all(exp.Column):
+        name = column.name.upper()
+        select = column.find_ancestor(exp.Select)
+        scope = scopes.get(id(select))
+        if not name or name == "*" or scope is None:
+            continue
+        chain = visible(scope)
+        qualifier = column.table.upper()
+        if qualifier:
+            source = next((sources[qualifier] for sources in chain if qualifier in sources), None)
+            if source is not None and source[1] is not None and name not in source[1]:
+                resolver.problems.append(f"Column {name} does not exist in table {source[0]}{_suggest(name, source[1])}.")
+            continue
+        # Unqualified: a projection alias, or a column of some visible table
+        if name in {projection.alias.upper() for projection in select.selects if isinstance(projection, exp.Alias)}:
+            continue
+        sources = [source for sources in chain for source in sources.values()]
+        if not sources or any(columns is None for _, columns in sources):
+            continue
+        if not any(name in columns for _, columns in sources):
+            candidates = set().union(*(columns for _, columns in sources))
+            tables = ", ".join(sorted({table for table, _ in sources}))
+            resolver.problems.append(f"Column {name} does not exist in {tables}{_suggest(name, candidates)}.")
+
+    if resolver.problems:
+        count("rejected")
+        problems = list(dict.fromkeys(resolver.problems))
+        logger.info(f"Generated SQL rejected before execution: {problems}")
+        raise SqlValidationError(" ".join(problems))
@@ -0,0 +1,308 @@
+import os
+import re
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from logger_module import setup_logger
+
+logger = setup_logger()
+
+# Answer cache configurations from environment variables
+ANSWER_CACHE_BACKEND = os.getenv('ANSWER_CACHE_BACKEND', 'memory')  # memory | disk
+ANSWER_CACHE_DIR = os.getenv('ANSWER_CACHE_DIR', '.answer_cache')
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '512'))
+ANSWER_CACHE_MAX_BYTES = int(os.getenv('ANSWER_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+ANSWER_CACHE_RESULT_TTL = float(os.getenv('ANSWER_CACHE_RESULT_TTL', '300'))
+ANSWER_CACHE_SIMILARITY = float(os.getenv('ANSWER_CACHE_SIMILARITY', '0.92'))
+
+_WORD = re.compile(r"[a-z0-9_]+")
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+_QUOTED = re.compile(r"'([^']*)'|\"([^\"]*)\"")
+_NEGATIONS = {"not", "no", "non", "never", "none", "nor", "neither", "cannot", "without", "except", "excluding", "exclude", "excludes"}
+_NEGATING_PREFIXES = ("non", "un", "in", "im", "il", "ir", "dis")
+
+def normalize_prompt(prompt):
+    # Lowercase and collapse punctuation/whitespace so trivial rephrasings share a key
+    return " ".join(_WORD.findall((prompt or "").lower()))
+
+def prompt_literals(prompt):
+    """Numbers, quoted literals and negations: the parts of a prompt that change its answer
+    however similar the rest of the phrasing is."""
+    text = (prompt or "").lower()
+    words = _WORD.findall(text)
+    # "isn't" splits into "isn" and "t"
+    negations = sorted("not" if word == "t" else word for word in words if word in _NEGATIONS or word == "t")
+    return (sorted(_NUMBER.findall(text)), sorted(a or b for a, b in _QUOTED.findall(text)), negations)
+
+def _negated_pair(words, others):
+    # "active" vs "inactive", "paid" vs "unpaid"
+    return any(other == prefix + word or word == prefix + other
+               for word in words for other in others for prefix in _NEGATING_PREFIXES)
+
+def tables_key(tables):
+    names = sorted({str(t).strip().upper() for t in (tables or []) if t})
+    return hashlib.sha1("|".join(names).encode()).hexdigest()
+
+def cache_key(prompt, tables):
+    return hashlib.sha1(f"{tables_key(tables)}:{normalize_prompt(prompt)}".encode()).hexdigest()
+
+
+def _index_entry(entry):
+    return {field: entry.get(field) for field in ("prompt", "tables_key", "embedding", "literals")}
+
+
+class MemoryBackend:
+    """In-process LRU backend bounded by entry count."""
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def index(self):
+        with self._lock:
+            return [(key, _index_entry(entry)) for key, entry in self._entries.items()]
+
+
+class DiskBackend:
+    """On-disk backend, one pickle per entry, LRU by file mtime and bounded by count and bytes.
+    The fields the near-duplicate scan needs are kept in memory, so a miss reads no entries."""
+
+    def __init__(self, directory=ANSWER_CACHE_DIR, max_entries=ANSWER_CACHE_MAX_ENTRIES, max_bytes=ANSWER_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._index = self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def _index_path(self):
+        return os.path.join(self.directory, "index.idx")
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), 'rb') as file:
+                index = pickle.load(file)
+        except Exception as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.info(f"Rebuilding unreadable answer cache index: {str(e)}")
+            return self._rebuild_index()
+        # Entries evicted or removed by another process since the index was written
+        return {key: entry for key, entry in index.items() if os.path.exists(self._path(key))}
+
+    def _rebuild_index(self):
+        # Once, for a directory written without an index
+        index = {}
+        for _, _, name in self._files():
+            try:
+                with open(os.path.join(self.directory, name), 'rb') as file:
+                    index[name[:-4]] = _index_entry(pickle.load(file))
+            except Exception:
+                continue
+        return index
+
+    def _save_index(self):
+        tmp_path = self._index_path() + ".tmp"
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(self._index, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._index_path())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                entry = pickle.load(file)
+            os.utime(path)
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.info(f"Dropping unreadable answer cache entry {key}: {str(e)}")
+            self.delete(key)
+            return None
+
+    def put(self, key, entry):
+        with self._lock:
+            tmp_path = self._path(key) + ".tmp"
+            with open(tmp_path, 'wb') as file:
+                pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+            self._index[key] = _index_entry(entry)
+            self._evict()
+            self._save_index()
+
+    def delete(self, key):
+        with self._lock:
+            self._delete(key)
+            self._save_index()
+
+    def _delete(self, key):
+        # Caller holds self._lock
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        self._index.pop(key, None)
+
+    def _files(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.directory, name))
+                files.append((stat.st_mtime, stat.st_size, name))
+        return sorted(files)
+
+    def _evict(self):
+        files = self._files()
+        total_bytes = sum(size for _, size, _ in files)
+        while files and (len(files) > self.max_entries or total_bytes > self.max_bytes):
+            _, size, name = files.pop(0)
+            self._delete(name[:-4])
+            total_bytes -= size
+
+    def index(self):
+        # Read without get(): a scan must neither unpickle results nor refresh LRU mtimes
+        with self._lock:
+            return list(self._index.items())
+
+
+class AnswerCache:
+    """Caches generated responses/SQL per (normalized prompt, retrieved tables) and,
+    for ANSWER_CACHE_RESULT_TTL seconds, the result DataFrame as well."""
+
+    def __init__(self, backend=None, result_ttl=ANSWER_CACHE_RESULT_TTL,
+                 similarity_threshold=ANSWER_CACHE_SIMILARITY, embed_fn=None):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.result_ttl = result_ttl
+        self.similarity_threshold = similarity_threshold
+        # Optional callable text -> vector; without it only exact (normalized) prompts hit
+        self.embed_fn = embed_fn
+        self._lock = threading.Lock()
+        self._counters = {"exact_hits": 0, "similar_hits": 0, "misses": 0,
+                          "result_hits": 0, "result_misses": 0, "stores": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _embed(self, text):
+        if self.embed_fn is None:
+            return None
+        try:
+            return list(self.embed_fn(text))
+        except Exception as e:
+            logger.info(f"Answer cache embedding failed: {str(e)}")
+            return None
+
+    def _similarity(self, embedding, entry):
+        other = entry.get("embedding")
+        if embedding is None or other is None:
+            return 0.0
+        dot = sum(a * b for a, b in zip(embedding, other))
+        norm = (sum(a * a for a in embedding) ** 0.5) * (sum(b * b for b in other) ** 0.5)
+        return dot / norm if norm else 0.0
+
+    @staticmethod
+    def _same_literals(prompt, normalized, entry):
+        # Embeddings score "customer 12345" and "customer 12346" as near-identical
+        if entry.get("literals") != prompt_literals(prompt):
+            return False
+        words, others = set(normalized.split()), set(entry["prompt"].split())
+        return not _negated_pair(words - others, others - words)
+
+    def lookup(self, prompt, tables):
+        entry = self.backend.get(cache_key(prompt, tables))
+        if entry is not None:
+            self._count("exact_hits")
+            return entry
+
+        # Near-duplicate phrasing against entries retrieved for the same table set
+        normalized = normalize_prompt(prompt)
+        embedding = self._embed(normalized)
+        if embedding is not None:
+            table_key = tables_key(tables)
+            best, best_score = None, self.similarity_threshold
+            for key, candidate in self.backend.index():
+                if candidate.get("tables_key") != table_key:
+                    continue
+                score = self._similarity(embedding, candidate)
+                if score >= best_score and self._same_literals(prompt, normalized, candidate):
+                    best, best_score = key, score
+            entry = self.backend.get(best) if best is not None else None
+            if entry is not None:
+                self._count("similar_hits")
+                return entry
+
+        self._count("misses")
+        return None
+
+    def results(self, entry):
+        # Returns the cached DataFrame only while it is within the TTL
+        if entry is not None and entry.get("results") is not None \
+                and time.time() - entry["results_at"] <= self.result_ttl:
+            self._count("result_hits")
+            return entry["results"]
+        self._count("result_misses")
+        return None
+
+    def store(self, prompt, tables, response, sql=None, results=None):
+        normalized = normalize_prompt(prompt)
+        entry = {
+            "prompt": normalized,
+            "tables_key": tables_key(tables),
+            "response": response,
+            "sql": sql,
+            "results": results,
+            "results_at": time.time(),
+            "embedding": self._embed(normalized),
+            "literals": prompt_literals(prompt),
+        }
+        self.backend.put(cache_key(prompt, tables), entry)
+        self._count("stores")
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["exact_hits"] + counters["similar_hits"] + counters["misses"]
+        counters["llm_calls_saved"] = counters["exact_hits"] + counters["similar_hits"]
+        counters["warehouse_queries_saved"] = counters["result_hits"]
+        counters["hit_rate"] = counters["llm_calls_saved"] / lookups if lookups else 0.0
+        return counters
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+def get_answer_cache():
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            if ANSWER_CACHE_BACKEND == 'disk':
+                backend = DiskBackend()
+            else:
+                backend = MemoryBackend()
+            _answer_cache = AnswerCache(backend=backend)
+        return _answer_cache
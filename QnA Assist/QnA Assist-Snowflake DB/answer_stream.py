@@ -0,0 +1,50 @@
+import re
+import time
+
+# Fenced blocks the prompts ask the model to wrap SQL and API calls in
+FENCES = {
+    "sql": re.compile(r"```sql\n(.*?)\n```", re.DOTALL),
+    "GET": re.compile(r"```GET\n(.*?)\n```", re.DOTALL),
+}
+
+
+class AnswerStream:
+    """Accumulates a streamed completion, timing the first token and handing back each fenced
+    block as soon as its closing fence arrives, while the model may still be writing prose."""
+
+    def __init__(self, fence="sql"):
+        self.pattern = FENCES[fence]
+        self.text = ""
+        self.blocks = []
+        self.started = time.perf_counter()
+        self.ttft = None
+        self.first_block = None
+        self.total = None
+        self._scan_from = 0
+
+    def feed(self, delta):
+        """Append one streamed delta; returns the blocks it closed."""
+        if not delta:
+            return []
+        now = time.perf_counter() - self.started
+        if self.ttft is None:
+            self.ttft = now
+        self.text += delta
+        closed = []
+        for match in self.pattern.finditer(self.text, self._scan_from):
+            closed.append(match.group(1))
+            self._scan_from = match.end()
+        if closed and self.first_block is None:
+            self.first_block = now
+        self.blocks.extend(closed)
+        return closed
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+        return self.text
+
+    def timings(self):
+        def seconds(value):
+            return round(value, 3) if value is not None else None
+        return {"ttft": seconds(self.ttft), "first_block": seconds(self.first_block), "total": seconds(self.total),
+                "chars": len(self.text)}
@@ -0,0 +1,127 @@
+import os
+import hashlib
+import threading
+from collections import deque
+from token_count import count_tokens
+from llm_dispatch import PRIORITY_BACKGROUND
+from logger_module import setup_logger
+
+logger = setup_logger()
+
+# Conversation memory configurations from environment variables
+MEMORY_TOKEN_BUDGET = int(os.getenv('MEMORY_TOKEN_BUDGET', '6000'))
+MEMORY_KEEP_TURNS = int(os.getenv('MEMORY_KEEP_TURNS', '6'))
+MEMORY_SUMMARY_TOKENS = int(os.getenv('MEMORY_SUMMARY_TOKENS', '300'))
+
+SUMMARY_PROMPT = """
+Summarize the conversation below between a user and a data assistant in at most {max_tokens} tokens.
+Keep the questions asked, the tables, APIs, filters and values they referred to, and any conclusions.
+Leave out SQL text and result rows.
+"""
+
+# Per-message overhead of the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def message_tokens(message):
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def llm_summarizer(llm, max_tokens=MEMORY_SUMMARY_TOKENS):
+    """A summarize(previous_summary, turns) function backed by an LlmDispatcher, queued behind user requests."""
+    def summarize(previous_summary, turns):
+        transcript = ""
+        if previous_summary:
+            transcript += f"Earlier summary: {previous_summary}\n"
+        for user, assistant in turns:
+            transcript += f"User: {user['content']}\nAssistant: {assistant['content']}\n"
+        response = llm.complete(
+            priority=PRIORITY_BACKGROUND,
+            messages=[{"role": "system", "content": SUMMARY_PROMPT.format(max_tokens=max_tokens)},
+                      {"role": "user", "content": transcript}],
+            max_tokens=max_tokens,
+        )
+        return response.choices[0].message.content
+    return summarize
+
+
+class ConversationMemory:
+    """Bounded history sent with each completion: the base system prompt, a rolling summary of
+    evicted turns, the latest turns that fit the token budget, and only the current turn's
+    schema/API context. Stored result DataFrames never reach the model.
+
+    Evicted turns are folded into the summary on a background thread, so a turn never waits
+    on summarization."""
+
+    def __init__(self, system_prompt, summarize=None, token_budget=MEMORY_TOKEN_BUDGET, keep_turns=MEMORY_KEEP_TURNS):
+        self.system = {"role": "system", "content": system_prompt}
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.summary = ""
+        self.turns = []
+        self.turn_tokens = deque(maxlen=100)
+        self._evicted = []
+        self._summarizing = False
+        self._lock = threading.Lock()
+
+    def messages(self, prompt, context):
+        """Messages for the next completion; older turns are evicted until they fit the budget."""
+        current = [{"role": "user", "content": prompt}, {"role": "system", "content": context}]
+        with self._lock:
+            head = [self.system]
+            if self.summary:
+                head.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+            fixed = sum(message_tokens(message) for message in head + current)
+            turn_sizes = [message_tokens(user) + message_tokens(assistant) for user, assistant in self.turns]
+            while self.turns and fixed + sum(turn_sizes) > self.token_budget:
+                self._evicted.append(self.turns.pop(0))
+                turn_sizes.pop(0)
+            messages = head + [message for turn in self.turns for message in turn] + current
+            prompt_tokens = fixed + sum(turn_sizes)
+            self.turn_tokens.append(prompt_tokens)
+        self._start_summary()
+        return messages
+
+    def add_turn(self, prompt, answer):
+        with self._lock:
+            self.turns.append(({"role": "user", "content": prompt}, {"role": "assistant", "content": answer}))
+            while len(self.turns) > self.keep_turns:
+                self._evicted.append(self.turns.pop(0))
+        self._start_summary()
+
+    def _start_summary(self):
+        with self._lock:
+            if self.summarize is None:
+                self._evicted = []
+                return
+            if self._summarizing or not self._evicted:
+                return
+            self._summarizing = True
+        threading.Thread(target=self._fold_evicted, name="MemorySummary", daemon=True).start()
+
+    def _fold_evicted(self):
+        with self._lock:
+            evicted, self._evicted = self._evicted, []
+            previous = self.summary
+        try:
+            summary = self.summarize(previous, evicted)
+        except Exception as e:
+            logger.info(f"Conversation summary failed, keeping the previous one: {str(e)}")
+            summary = previous
+        with self._lock:
+            self.summary = summary
+            self._summarizing = False
+        # Turns evicted while this summary was being written
+        self._start_summary()
+
+    def digest(self):
+        """Identifies the conversation so far; equal digests mean the model sees the same history."""
+        with self._lock:
+            parts = [self.summary] + [message["content"] for turn in self.turns for message in turn]
+        return hashlib.sha1("\x1f".join(parts).encode()).hexdigest()
+
+    def stats(self):
+        with self._lock:
+            return {"turns": len(self.turns), "summary_tokens": count_tokens(self.summary) if self.summary else 0,
+                    "prompt_tokens": list(self.turn_tokens)}
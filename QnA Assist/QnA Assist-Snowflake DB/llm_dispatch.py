@@ -0,0 +1,716 @@
+import os
+import json
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from token_count import count_tokens
+from tracing import annotate
+from services import lazy_service, AZURE_OPENAI_API_VERSION, DEPLOYMENT_NAME
+from logger_module import setup_logger
+
+logger = setup_logger()
+
+# LLM dispatch configurations from environment variables
+LLM_DEPLOYMENTS = os.getenv('LLM_DEPLOYMENTS', '')  # JSON list of deployments; DEPLOYMENT_NAME alone when empty
+LLM_TPM = int(os.getenv('LLM_TPM', '30000'))  # Quota of the DEPLOYMENT_NAME deployment
+LLM_RPM = int(os.getenv('LLM_RPM', '180'))
+LLM_BURST_SECONDS = float(os.getenv('LLM_BURST_SECONDS', '10'))  # Azure enforces quotas over short windows, not per minute
+LLM_COMPLETION_ESTIMATE = int(os.getenv('LLM_COMPLETION_ESTIMATE', '800'))  # Reserved for the completion when max_tokens isn't set
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '60'))
+LLM_MAX_ATTEMPTS = int(os.getenv('LLM_MAX_ATTEMPTS', '4'))  # A 429 is retried on whichever deployment has room
+LLM_THROTTLE_SECONDS = float(os.getenv('LLM_THROTTLE_SECONDS', '10'))  # Cool-down after a 429 without retry-after
+LLM_FIRST_TOKEN_TIMEOUT = float(os.getenv('LLM_FIRST_TOKEN_TIMEOUT', '30'))  # Streams without a first token by then fail over
+LLM_REQUEST_TIMEOUT = float(os.getenv('LLM_REQUEST_TIMEOUT', '120'))
+LLM_HEDGE = os.getenv('LLM_HEDGE', 'true').lower() == 'true'
+LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', '0.95'))  # Streams slower to start than this share of recent ones are hedged
+LLM_HEDGE_AFTER = float(os.getenv('LLM_HEDGE_AFTER', '5'))  # Used until a deployment has LLM_HEDGE_MIN_SAMPLES first-token times
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+LLM_TTFT_WINDOW = int(os.getenv('LLM_TTFT_WINDOW', '200'))
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '3'))  # Consecutive failures or lost hedges that open the breaker
+LLM_BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', '30'))
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# Per-message overhead of the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class LlmQuotaError(Exception):
+    pass
+
+
+def estimate_tokens(messages, max_tokens=None):
+    """Tokens a request counts against TPM: the prompt plus the completion it may produce."""
+    prompt = sum(count_tokens(message["content"] or "") + MESSAGE_OVERHEAD_TOKENS for message in messages)
+    return prompt, prompt + (max_tokens or LLM_COMPLETION_ESTIMATE)
+
+
+def _header(headers, name):
+    try:
+        value = headers.get(name)
+        return float(value) if value is not None else None
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _status(error):
+    return getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+
+
+def _retryable(error):
+    """Worth another deployment: throttling, server errors, timeouts and connection failures."""
+    status = _status(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, TimeoutError) or hasattr(error, "request")
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+async def _prefetch(stream):
+    """Wait for the first chunk carrying text; returns an iterator replaying what was read, then the rest."""
+    iterator = stream.__aiter__()
+    head = []
+    while True:
+        try:
+            chunk = await iterator.__anext__()
+        except StopAsyncIteration:
+            break
+        head.append(chunk)
+        # Azure sends content filter results ahead of the first token
+        if chunk.choices and chunk.choices[0].delta.content:
+            break
+
+    async def replay():
+        for chunk in head:
+            yield chunk
+        async for chunk in iterator:
+            yield chunk
+    return replay()
+
+
+def _close(stream):
+    try:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    except Exception:
+        pass
+
+
+async def _aclose(stream):
+    try:
+        close = getattr(stream, "close", None) or getattr(stream, "aclose", None)
+        if close is not None:
+            result = close()
+            if asyncio.iscoroutine(result):
+                await result
+    except Exception:
+        pass
+
+
+class TokenBucket:
+    """A per-minute quota refilled continuously, holding at most burst_seconds of it. The level
+    can go negative when a request turns out bigger than reserved."""
+
+    def __init__(self, per_minute, burst_seconds=LLM_BURST_SECONDS):
+        self.per_minute = per_minute
+        self.burst_seconds = burst_seconds
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def capacity(self):
+        return max(self.per_minute * self.burst_seconds / 60, 1)
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        # A request bigger than the bucket only waits for a full one
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return missing * 60 / self.per_minute if missing > 0 else 0.0
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.level -= amount
+
+    def observe(self, remaining, limit, now):
+        """Align with the x-ratelimit-* headers; the service knows about traffic we don't."""
+        if limit:
+            self.per_minute = limit
+        self._refill(now)
+        if remaining is not None:
+            self.level = min(self.level, remaining)
+
+
+class CircuitBreaker:
+    """Opens after `failures` consecutive failures and stays open for `cooldown` seconds. It then
+    lets one trial request through: success closes it, failure opens it again."""
+
+    def __init__(self, failures=LLM_BREAKER_FAILURES, cooldown=LLM_BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.trial = False
+
+    def wait_time(self, now):
+        if self.state == "open":
+            remaining = self.opened_at + self.cooldown - now
+            if remaining > 0:
+                return remaining
+            self.state = "half_open"
+        if self.state == "half_open" and self.trial:
+            # Until the trial reports back
+            return self.cooldown
+        return 0.0
+
+    def dispatched(self):
+        if self.state == "half_open":
+            self.trial = True
+
+    def succeeded(self):
+        self.state = "closed"
+        self.consecutive = 0
+        self.trial = False
+
+    def failed(self, now):
+        """True when this failure opened the breaker."""
+        self.consecutive += 1
+        self.trial = False
+        if self.state == "half_open" or (self.state == "closed" and self.consecutive >= self.failures):
+            self.state = "open"
+            self.opened_at = now
+            self.opens += 1
+            return True
+        return False
+
+    def abandoned(self):
+        # Neither success nor failure (cancelled, throttled): let another trial go
+        self.trial = False
+
+
+class Deployment:
+    """One Azure OpenAI deployment with its TPM/RPM quota. Deployments of the lowest tier are
+    used first and share traffic by weight; higher tiers take what they can't."""
+
+    def __init__(self, name, endpoint=None, api_key=None, api_version=AZURE_OPENAI_API_VERSION, tpm=LLM_TPM,
+                 rpm=LLM_RPM, weight=1, tier=0, label=None, client=None, async_client=None):
+        self.name = name
+        self.endpoint = endpoint or os.getenv("AZURE_OPENAI_ENDPOINT")
+        self.api_key = api_key or os.getenv("AZURE_OPENAI_API_KEY")
+        self.api_version = api_version
+        self.label = label or name
+        self.weight = weight
+        self.tier = tier
+        self.tokens = TokenBucket(tpm)
+        self.requests = TokenBucket(rpm)
+        self.cooldown_until = 0.0
+        self.current_weight = 0
+        self.breaker = CircuitBreaker()
+        self.ttfts = deque(maxlen=LLM_TTFT_WINDOW)
+        self.metrics = {"dispatched": 0, "throttled": 0, "errors": 0, "failures": 0, "lost_hedges": 0, "tokens_used": 0}
+        self._client = client
+        self._async_client = async_client
+        self._client_lock = threading.Lock()
+
+    # Retries are the dispatcher's job, so a 429 can move to another deployment instead of sleeping here
+    def client(self):
+        with self._client_lock:
+            if self._client is None:
+                from openai import AzureOpenAI
+                self._client = AzureOpenAI(api_key=self.api_key, api_version=self.api_version,
+                                           azure_endpoint=self.endpoint, max_retries=0)
+            return self._client
+
+    def async_client(self):
+        with self._client_lock:
+            if self._async_client is None:
+                from openai import AsyncAzureOpenAI
+                self._async_client = AsyncAzureOpenAI(api_key=self.api_key, api_version=self.api_version,
+                                                      azure_endpoint=self.endpoint, max_retries=0)
+            return self._async_client
+
+    def wait_time(self, tokens, now):
+        return max(self.cooldown_until - now, self.breaker.wait_time(now), self.tokens.wait_time(tokens, now),
+                   self.requests.wait_time(1, now))
+
+    def hedge_after(self):
+        """Seconds without a first token after which a stream on this deployment is hedged."""
+        if len(self.ttfts) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_AFTER
+        return _percentile(self.ttfts, LLM_HEDGE_PERCENTILE)
+
+    def stats(self, now):
+        self.tokens.wait_time(0, now)
+        self.requests.wait_time(0, now)
+        return dict(self.metrics, deployment=self.name, tier=self.tier, weight=self.weight,
+                    tpm=self.tokens.per_minute, rpm=self.requests.per_minute,
+                    tokens_available=round(self.tokens.level),
+                    requests_available=round(self.requests.level, 1),
+                    cooldown_s=round(max(self.cooldown_until - now, 0), 1), breaker=self.breaker.state,
+                    breaker_opens=self.breaker.opens, hedge_after_s=round(self.hedge_after(), 3),
+                    ttft_p50_s=round(_percentile(self.ttfts, 0.5), 3) if self.ttfts else None)
+
+
+class LlmCall:
+    """One dispatched completion. For streams, set completion_tokens once the stream is drained."""
+
+    def __init__(self, deployment, prompt_tokens, reserved, response, headers):
+        self.deployment = deployment
+        self.prompt_tokens = prompt_tokens
+        self.reserved = reserved
+        self.response = response
+        self.headers = headers
+        self.stream = None
+        self.completion_tokens = None
+
+
+class _Ticket:
+    __slots__ = ("priority", "seq", "tokens", "avoid", "enqueued", "event", "loop")
+
+    def __init__(self, priority, seq, tokens, avoid=(), loop=None):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.avoid = avoid
+        self.enqueued = time.monotonic()
+        self.loop = loop
+        self.event = asyncio.Event() if loop is not None else threading.Event()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            # Its loop is gone, and the waiter with it
+            pass
+
+
+class LlmDispatcher:
+    """Sends chat completions to the deployment with quota for them. Each deployment's TPM/RPM
+    is modelled as token buckets, charged with the estimated tokens up front, corrected with the
+    actual usage and the x-ratelimit-* headers afterwards. Requests wait in one priority queue
+    and only the head may dispatch, so a large prompt isn't starved by small ones. A 429 puts
+    the deployment in cool-down and the request back in the queue for another one.
+
+    Failures, timeouts and lost hedges count against a deployment's circuit breaker; a failed
+    request is retried on another deployment. A stream whose first token is later than its
+    deployment's usual hedge_after is hedged on another deployment with quota to spare, and
+    whichever starts first is kept."""
+
+    def __init__(self, deployments, queue_timeout=LLM_QUEUE_TIMEOUT, max_attempts=LLM_MAX_ATTEMPTS):
+        self.deployments = deployments
+        self.queue_timeout = queue_timeout
+        self.max_attempts = max_attempts
+        self._waiting = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.metrics = {"queued": 0, "spillovers": 0, "retries": 0, "queue_timeouts": 0, "queue_wait_max_s": 0.0,
+                        "streams": 0, "hedges": 0, "hedge_wins": 0, "hedges_skipped": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.metrics[name] += 1
+
+    def _route(self, tokens, now, avoid=(), fallback=True):
+        """Deployment to use now, or None and the seconds until one has room. Deployments in
+        avoid are only used when there is no other, and never without fallback."""
+        waits = []
+        candidates = [deployment for deployment in self.deployments if deployment not in avoid]
+        if not candidates and fallback:
+            candidates = self.deployments
+        tiers = sorted({deployment.tier for deployment in candidates})
+        for tier in tiers:
+            ready = []
+            for deployment in candidates:
+                if deployment.tier == tier:
+                    wait = deployment.wait_time(tokens, now)
+                    if wait > 0:
+                        waits.append(wait)
+                    else:
+                        ready.append(deployment)
+            if ready:
+                # Smooth weighted round robin within the tier
+                total = sum(deployment.weight for deployment in ready)
+                for deployment in ready:
+                    deployment.current_weight += deployment.weight
+                chosen = max(ready, key=lambda deployment: deployment.current_weight)
+                chosen.current_weight -= total
+                if tier != tiers[0]:
+                    self.metrics["spillovers"] += 1
+                return chosen, 0.0
+        return None, min(waits, default=None)
+
+    def _reserve(self, deployment, tokens, now):
+        deployment.tokens.take(tokens, now)
+        deployment.requests.take(1, now)
+        deployment.breaker.dispatched()
+        deployment.metrics["dispatched"] += 1
+
+    def _enqueue(self, tokens, priority, seq, avoid, loop):
+        ticket = _Ticket(priority, next(self._seq) if seq is None else seq, tokens, avoid, loop)
+        with self._lock:
+            heapq.heappush(self._waiting, ticket)
+            self.metrics["queued"] += 1
+        return ticket
+
+    def _poll(self, ticket):
+        """(deployment, 0) once ticket is dispatched, else (None, seconds to wait; None until woken)."""
+        now = time.monotonic()
+        with self._lock:
+            if self._waiting[0] is not ticket:
+                return None, None
+            deployment, delay = self._route(ticket.tokens, now, ticket.avoid)
+            if deployment is None:
+                return None, delay
+            heapq.heappop(self._waiting)
+            self._reserve(deployment, ticket.tokens, now)
+            waited = now - ticket.enqueued
+            self.metrics["queue_wait_max_s"] = round(max(self.metrics["queue_wait_max_s"], waited), 3)
+        self._wake_head()
+        annotate(llm_deployment=deployment.label, llm_queue_s=round(waited, 4))
+        return deployment, 0.0
+
+    def _try_acquire(self, tokens, avoid):
+        """A deployment outside avoid with room right now, or None. Never queues, and never goes
+        ahead of queued requests."""
+        now = time.monotonic()
+        with self._lock:
+            if self._waiting:
+                return None
+            deployment, _ = self._route(tokens, now, avoid, fallback=False)
+            if deployment is not None:
+                self._reserve(deployment, tokens, now)
+            return deployment
+
+    def _wake_head(self):
+        with self._lock:
+            head = self._waiting[0] if self._waiting else None
+        if head is not None:
+            head.wake()
+
+    def _abandon(self, ticket):
+        with self._lock:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+        self._wake_head()
+
+    def _deadline_passed(self, deadline):
+        if time.monotonic() < deadline:
+            return False
+        with self._lock:
+            self.metrics["queue_timeouts"] += 1
+        return True
+
+    def acquire(self, tokens, priority=PRIORITY_INTERACTIVE, seq=None, avoid=()):
+        ticket = self._enqueue(tokens, priority, seq, avoid, None)
+        deadline = time.monotonic() + self.queue_timeout
+        try:
+            while True:
+                ticket.event.clear()
+                deployment, delay = self._poll(ticket)
+                if deployment is not None:
+                    return deployment
+                if self._deadline_passed(deadline):
+                    raise LlmQuotaError(f"No LLM deployment had quota within {self.queue_timeout:.0f}s")
+                # Woken early when the queue moves or quota comes back
+                ticket.event.wait(min(delay or 1.0, deadline - time.monotonic()))
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+    async def aacquire(self, tokens, priority=PRIORITY_INTERACTIVE, seq=None, avoid=()):
+        ticket = self._enqueue(tokens, priority, seq, avoid, asyncio.get_running_loop())
+        deadline = time.monotonic() + self.queue_timeout
+        try:
+            while True:
+                ticket.event.clear()
+                deployment, delay = self._poll(ticket)
+                if deployment is not None:
+                    return deployment
+                if self._deadline_passed(deadline):
+                    raise LlmQuotaError(f"No LLM deployment had quota within {self.queue_timeout:.0f}s")
+                try:
+                    await asyncio.wait_for(ticket.event.wait(), min(delay or 1.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+    def _throttled(self, deployment, error):
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        retry_ms = _header(headers, "retry-after-ms")
+        retry_after = retry_ms / 1000 if retry_ms is not None else _header(headers, "retry-after") or LLM_THROTTLE_SECONDS
+        now = time.monotonic()
+        with self._lock:
+            deployment.cooldown_until = max(deployment.cooldown_until, now + retry_after)
+            deployment.tokens.observe(0, None, now)
+            deployment.breaker.abandoned()
+            deployment.metrics["throttled"] += 1
+        logger.warning(f"LLM deployment {deployment.label} throttled, cooling down for {retry_after:.1f}s")
+
+    def _settle(self, call, used=None):
+        """Replace the reservation with the tokens actually used and sync with the response headers."""
+        if used is None:
+            completion = call.completion_tokens
+            used = call.reserved if completion is None else call.prompt_tokens + completion
+        headers = call.headers or {}
+        now = time.monotonic()
+        deployment = call.deployment
+        with self._lock:
+            deployment.tokens.take(used - call.reserved, now)
+            deployment.tokens.observe(_header(headers, "x-ratelimit-remaining-tokens"),
+                                      _header(headers, "x-ratelimit-limit-tokens"), now)
+            deployment.requests.observe(_header(headers, "x-ratelimit-remaining-requests"),
+                                        _header(headers, "x-ratelimit-limit-requests"), now)
+            deployment.metrics["tokens_used"] += used
+        # Returned quota may let the head go sooner than it planned
+        self._wake_head()
+
+    def _succeeded(self, deployment, ttft=None):
+        with self._lock:
+            deployment.breaker.succeeded()
+            if ttft is not None:
+                deployment.ttfts.append(ttft)
+
+    def _trip(self, deployment, reason):
+        with self._lock:
+            opened = deployment.breaker.failed(time.monotonic())
+        if opened:
+            logger.warning(f"LLM deployment {deployment.label} circuit opened for {deployment.breaker.cooldown:.0f}s: {reason}")
+
+    def _failed(self, deployment, prompt_tokens, reserved, error):
+        if _status(error) == 429:
+            self._throttled(deployment, error)
+        elif isinstance(error, Exception) and _retryable(error):
+            with self._lock:
+                deployment.metrics["errors"] += 1
+                deployment.metrics["failures"] += 1
+            self._trip(deployment, str(error) or type(error).__name__)
+        else:
+            # Cancelled, or a client error that says nothing about the deployment's health
+            with self._lock:
+                deployment.metrics["errors"] += isinstance(error, Exception)
+                deployment.breaker.abandoned()
+        # The prompt may have been charged, the completion wasn't
+        self._settle(LlmCall(deployment, prompt_tokens, reserved, None, None), used=prompt_tokens)
+
+    @staticmethod
+    def _unwrap(raw):
+        # Raw responses carry the rate limit headers; plain clients (tests, benchmarks) don't
+        if hasattr(raw, "parse") and hasattr(raw, "headers"):
+            return raw.parse(), raw.headers
+        return raw, {}
+
+    @staticmethod
+    def _usage(call):
+        usage = getattr(call.response, "usage", None)
+        return getattr(usage, "total_tokens", None)
+
+    def _retry(self, attempt, deployment, error, avoid):
+        if attempt >= self.max_attempts or not _retryable(error):
+            return False
+        avoid.add(deployment)
+        self._count("retries")
+        logger.info(f"LLM request failed on {deployment.label}, retrying: {str(error) or type(error).__name__}")
+        return True
+
+    def _start(self, deployment, prompt_tokens, reserved, messages, kwargs):
+        completions = deployment.client().chat.completions
+        timeout = LLM_FIRST_TOKEN_TIMEOUT if kwargs.get("stream") else LLM_REQUEST_TIMEOUT
+        try:
+            raw = getattr(completions, "with_raw_response", completions).create(
+                model=deployment.name, messages=messages, timeout=timeout, **kwargs)
+        except BaseException as e:
+            self._failed(deployment, prompt_tokens, reserved, e)
+            raise
+        self._succeeded(deployment)
+        call = LlmCall(deployment, prompt_tokens, reserved, *self._unwrap(raw))
+        call.stream = call.response if kwargs.get("stream") else None
+        return call
+
+    async def _astart(self, deployment, prompt_tokens, reserved, messages, kwargs):
+        """Send the request to deployment; a stream returns once its first token has arrived."""
+        streamed = kwargs.get("stream")
+        started = time.monotonic()
+        call = None
+
+        async def start():
+            nonlocal call
+            completions = deployment.async_client().chat.completions
+            raw = await getattr(completions, "with_raw_response", completions).create(
+                model=deployment.name, messages=messages, **kwargs)
+            call = LlmCall(deployment, prompt_tokens, reserved, *self._unwrap(raw))
+            if streamed:
+                call.stream = call.response
+                call.response = await _prefetch(call.stream)
+            return call
+        try:
+            await asyncio.wait_for(start(), LLM_FIRST_TOKEN_TIMEOUT if streamed else LLM_REQUEST_TIMEOUT)
+        except BaseException as e:
+            if streamed and isinstance(e, (asyncio.CancelledError, asyncio.TimeoutError)):
+                # A lost or timed-out start still waited this long; without it only winners are sampled
+                # and hedge_after falls with every hedge
+                with self._lock:
+                    deployment.ttfts.append(time.monotonic() - started)
+            if call is not None and call.stream is not None:
+                await _aclose(call.stream)
+            self._failed(deployment, prompt_tokens, reserved, e)
+            raise
+        self._succeeded(deployment, time.monotonic() - started if streamed else None)
+        return call
+
+    async def _discard(self, call):
+        await _aclose(call.stream)
+        self._settle(call, used=call.prompt_tokens)
+
+    async def _ahedge(self, deployment, prompt_tokens, reserved, messages, kwargs):
+        """Stream from deployment; once it is later than its hedge_after, also from another
+        deployment, keeping whichever starts first and cancelling the other."""
+        tasks = [asyncio.ensure_future(self._astart(deployment, prompt_tokens, reserved, messages, kwargs))]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=deployment.hedge_after())
+            if not done:
+                alternate = self._try_acquire(reserved, {deployment})
+                if alternate is None:
+                    self._count("hedges_skipped")
+                else:
+                    self._count("hedges")
+                    tasks.append(asyncio.ensure_future(self._astart(alternate, prompt_tokens, reserved, messages, kwargs)))
+            pending = set(tasks)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in tasks:
+                    if task in done and task.exception() is None:
+                        winner = task
+                        break
+            if winner is None:
+                # Both failed: report the original request's error
+                return tasks[0].result()
+            if len(tasks) > 1:
+                hedge_won = winner is tasks[1]
+                annotate(llm_hedged=True, llm_hedge_won=hedge_won)
+                if hedge_won:
+                    self._count("hedge_wins")
+                    with self._lock:
+                        deployment.metrics["lost_hedges"] += 1
+                    self._trip(deployment, "slower than its hedge")
+            return winner.result()
+        finally:
+            for task in tasks:
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None:
+                    await self._discard(task.result())
+
+    def _call(self, messages, priority, kwargs):
+        prompt_tokens, reserved = estimate_tokens(messages, kwargs.get("max_tokens"))
+        seq = next(self._seq)
+        avoid = set()
+        for attempt in range(1, self.max_attempts + 1):
+            deployment = self.acquire(reserved, priority, seq, avoid)
+            try:
+                return self._start(deployment, prompt_tokens, reserved, messages, kwargs)
+            except Exception as e:
+                if not self._retry(attempt, deployment, e, avoid):
+                    raise
+
+    async def _acall(self, messages, priority, kwargs):
+        prompt_tokens, reserved = estimate_tokens(messages, kwargs.get("max_tokens"))
+        seq = next(self._seq)
+        avoid = set()
+        hedged = LLM_HEDGE and kwargs.get("stream") and len(self.deployments) > 1
+        for attempt in range(1, self.max_attempts + 1):
+            deployment = await self.aacquire(reserved, priority, seq, avoid)
+            try:
+                if hedged:
+                    return await self._ahedge(deployment, prompt_tokens, reserved, messages, kwargs)
+                return await self._astart(deployment, prompt_tokens, reserved, messages, kwargs)
+            except Exception as e:
+                if not self._retry(attempt, deployment, e, avoid):
+                    raise
+
+    def complete(self, messages, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """chat.completions.create on a deployment with quota; returns the response."""
+        call = self._call(messages, priority, kwargs)
+        self._settle(call, self._usage(call))
+        return call.response
+
+    async def acomplete(self, messages, priority=PRIORITY_INTERACTIVE, **kwargs):
+        call = await self._acall(messages, priority, kwargs)
+        self._settle(call, self._usage(call))
+        return call.response
+
+    @contextmanager
+    def stream(self, messages, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """Streamed completion: iterate call.response and set call.completion_tokens at the end.
+        A stream left early is charged its full reservation. Only async streams are hedged."""
+        self._count("streams")
+        call = self._call(messages, priority, dict(kwargs, stream=True))
+        try:
+            yield call
+        finally:
+            _close(call.stream)
+            self._settle(call)
+
+    @asynccontextmanager
+    async def astream(self, messages, priority=PRIORITY_INTERACTIVE, **kwargs):
+        self._count("streams")
+        call = await self._acall(messages, priority, dict(kwargs, stream=True))
+        try:
+            yield call
+        finally:
+            await _aclose(call.stream)
+            self._settle(call)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            hedges = self.metrics["hedges"]
+            return dict(self.metrics, waiting=len(self._waiting),
+                        hedge_rate=round(hedges / self.metrics["streams"], 4) if self.metrics["streams"] else 0.0,
+                        hedge_win_rate=round(self.metrics["hedge_wins"] / hedges, 4) if hedges else None,
+                        deployments={deployment.label: deployment.stats(now) for deployment in self.deployments})
+
+
+def load_deployments(config=LLM_DEPLOYMENTS):
+    """Deployments from LLM_DEPLOYMENTS, a JSON list of
+    {"name", "endpoint", "api_key_env", "tpm", "rpm", "weight", "tier", "label"}."""
+    if not config:
+        return [Deployment(DEPLOYMENT_NAME)]
+    deployments = []
+    for entry in json.loads(config):
+        entry = dict(entry)
+        api_key_env = entry.pop("api_key_env", "AZURE_OPENAI_API_KEY")
+        deployments.append(Deployment(api_key=os.getenv(api_key_env), **entry))
+    return deployments
+
+
+@lazy_service
+def get_llm_dispatcher():
+    return LlmDispatcher(load_deployments())
@@ -1,14 +1,73 @@
-import logging
-import json
+import os
 import sys
-from datetime import datetime
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+try:
+    import orjson
+
+    def _dumps(value):
+        return orjson.dumps(value, default=str).decode()
+except ImportError:
+    import json
+    _dumps = json.JSONEncoder(default=str, ensure_ascii=False, separators=(",", ":")).encode
 
 WRITE_TO_FILE = False
 
+# Logging configurations from environment variables
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FILE = os.getenv('LOG_FILE', 'application_logs.json' if WRITE_TO_FILE else '')
+LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', '')  # e.g. midnight or H for time-based rotation; size-based when empty
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(50 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))  # Records beyond this are dropped, never waited on
+LOG_RATE_LIMIT = int(os.getenv('LOG_RATE_LIMIT', '20'))  # Records per second from one call site; 0 disables
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.1'))  # Share of per-request detail records kept
+
+# logger.info(..., extra=SAMPLED) for per-request detail that is only useful in aggregate
+SAMPLED = {"sample": LOG_SAMPLE_RATE}
+
+_correlation_id = contextvars.ContextVar("log_correlation_id", default=None)
+
+
+def get_correlation_id():
+    return _correlation_id.get()
+
+
+@contextmanager
+def correlation_id(value):
+    """Tag every record logged in this context (including tasks and threads started from it) with value."""
+    token = _correlation_id.set(value)
+    try:
+        yield value
+    finally:
+        _correlation_id.reset(token)
+
+
 class JsonFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__()
+        self._second = None
+        self._second_text = ""
+
+    def _timestamp(self, created):
+        # The record's own creation time; the second is formatted once and reused
+        second = int(created)
+        if second != self._second:
+            self._second = second
+            self._second_text = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(second))
+        return f"{self._second_text}.{int((created - second) * 1e6):06d}"
+
     def format(self, record):
         log_message = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": self._timestamp(record.created),
             "threadName": record.threadName,
             "filename": record.filename,
             "line": record.lineno,
@@ -16,23 +75,117 @@ class JsonFormatter(logging.Formatter):
             "level": record.levelname,
             "message": record.getMessage()
         }
-        return json.dumps(log_message)
+        if getattr(record, "correlation_id", None):
+            log_message["correlation_id"] = record.correlation_id
+        if getattr(record, "suppressed", 0):
+            log_message["suppressed"] = record.suppressed
+        return _dumps(log_message)
+
+
+class HotPathFilter(logging.Filter):
+    """Runs on the caller's thread, before QueueHandler queues the record, so its state is
+    shared by every logging thread and kept under a lock. Records logged with
+    extra={"sample": p} are kept with probability p, and each call site is limited to
+    rate_limit records per second; the next record that passes reports how many were dropped."""
+
+    def __init__(self, rate_limit=LOG_RATE_LIMIT):
+        super().__init__()
+        self.rate_limit = rate_limit
+        self.sampled_out = 0
+        self.rate_limited = 0
+        self._windows = {}  # (pathname, lineno) -> [window second, records, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        sample = getattr(record, "sample", None)
+        if sample is not None and random.random() >= sample:
+            with self._lock:
+                self.sampled_out += 1
+            return False
+        if self.rate_limit <= 0 or record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        second = int(record.created)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or window[0] != second:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [second, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if window[1] >= self.rate_limit:
+                window[2] += 1
+                self.rate_limited += 1
+                return False
+            window[1] += 1
+            return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Queues records for the listener thread; a full queue drops the record instead of blocking."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Captured here because the listener thread does not share the caller's context
+        record.correlation_id = _correlation_id.get()
+        return super().prepare(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _file_handler(path):
+    if LOG_ROTATE_WHEN:
+        return TimedRotatingFileHandler(path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True)
+    return RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True)
+
+
+_queue_handler = None
+_hot_path_filter = None
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def _start_listener():
+    # One queue and one writer thread per process, shared by every module's logger
+    global _queue_handler, _hot_path_filter, _listener
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if LOG_FILE:
+        handlers.append(_file_handler(LOG_FILE))
+    formatter = JsonFormatter()
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    _queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _hot_path_filter = HotPathFilter()
+    _queue_handler.addFilter(_hot_path_filter)
+    _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # Flush what is still queued on shutdown
+    atexit.register(_listener.stop)
+
 
 def setup_logger(name="ApplicationLogger"):
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-
-    # Clear any existing handlers
-    logger.handlers = []
-
-    # Create a logging handler that writes log messages to stdout
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(JsonFormatter())
-    logger.addHandler(handler)
-
-    if WRITE_TO_FILE:
-        file_handler = logging.FileHandler("application_logs.json")
-        file_handler.setFormatter(JsonFormatter())
-        logger.addHandler(file_handler)
-    
-    return logger
\ No newline at end of file
+    logger.setLevel(LOG_LEVEL)
+
+    with _setup_lock:
+        if _listener is None:
+            _start_listener()
+        # Every call site shares the one queue handler
+        logger.handlers = [_queue_handler]
+
+    return logger
+
+
+def logging_stats():
+    if _queue_handler is None:
+        return {}
+    return {"queued": _queue_handler.queue.qsize(), "dropped": _queue_handler.dropped,
+            "sampled_out": _hot_path_filter.sampled_out, "rate_limited": _hot_path_filter.rate_limited}
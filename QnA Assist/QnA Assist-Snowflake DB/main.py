@@ -1,50 +1,59 @@
-import os
-import re
 import streamlit as st
-from openai import AzureOpenAI
 from prompts import get_system_prompt
-from snowflake_utils import get_snowflake_connection
+from snowflake_utils import snowflake_cursor
+from result_fetch import fetch_result
+from sql_guard import guard_sql
+from answer_cache import get_answer_cache
+from answer_stream import AnswerStream, FENCES
+from conversation_memory import ConversationMemory, llm_summarizer
+from result_store import ResultStore
+from token_count import count_tokens
+from tracing import span
+from services import get_search_client
+from llm_dispatch import get_llm_dispatcher
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from logger_module import setup_logger
 from dotenv import load_dotenv
-import json
-from azure.storage.blob import BlobServiceClient
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
-from azure.search.documents.indexes import SearchIndexClient
-from azure.search.documents.indexes.models import (
-    SearchIndex, SimpleField, SearchableField, SearchFieldDataType
-)
 
 st.title("Data QnA Assist") 
 
-#Establish OpenAI connection
-try:
-    client = AzureOpenAI(
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),  
-        api_version="2024-05-01-preview",
-        azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-        )
-except Exception as e:
-    st.error(f"Failed to establish OpenAI connection: {e}")
+# Process-wide clients, built on first use and reused by every rerun and session
+# Completions go to whichever configured deployment has quota left
+llm = get_llm_dispatcher()
 
-deployment_name=os.getenv("DEPLOYMENT_NAME")  
+search_client = get_search_client()
 
-# Set your Azure Blob Storage and Search service credentials
-blob_service_client = BlobServiceClient.from_connection_string(os.getenv("BLOB_CONNECTION_STRING"))
-container_name = os.getenv("CONTAINER_NAME")
+# Shared answer cache in front of the LLM -> SQL -> Snowflake loop
+answer_cache = get_answer_cache()
 
-# Define your Azure Search service endpoint and API key
-endpoint = os.getenv("AISEARCH_ENDPOINT")
-admin_key = os.getenv("AISEARCH_ADMIN_KEY")
-index_name = os.getenv("AISEARCH_INDEX_NAME")
+logger = setup_logger()
 
-# Create a SearchClient instance
-credential = AzureKeyCredential(admin_key)
-search_client = SearchClient(endpoint=endpoint, index_name=index_name, credential=credential)
+@st.cache_resource
+def get_query_executor():
+    # Queries start on a worker thread while the answer is still streaming
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="QueryWorker")
+
+def start_query(sql):
+    with snowflake_cursor() as cursor:
+        with span("sql.compile"):
+            sql = guard_sql(cursor, sql)
+        with span("sql.execute") as execute_span:
+            cursor.execute(sql)
+            execute_span.set("query_id", cursor.sfqid)
+            # Result batches are fetched after the connection is returned
+            return fetch_result(cursor)
 
 # Initialize the chat messages history
 if "messages" not in st.session_state:
     st.session_state.messages = [{"role": "system", "content": get_system_prompt()}]
     st.session_state.messages.append({"role": "assistant", "content": "Hello! How may I assist you today?"})
+# Full results live on disk, session state only keeps previews
+if "result_store" not in st.session_state:
+    st.session_state.result_store = ResultStore()
+# What is actually sent to the model: bounded, summarised, and without result DataFrames
+if "memory" not in st.session_state:
+    st.session_state.memory = ConversationMemory(get_system_prompt(), summarize=llm_summarizer(llm))
 
 # Define search parameters
 search_fields = ["summary"]  # Fields to search within
@@ -53,17 +62,30 @@ select_options = {"top": 5}  # Limit the number of results to top 5
 # Prompt for user input and save
 user_prompt = st.chat_input()
 if user_prompt:
-    res = search_client.search(search_text=user_prompt, search_fields=search_fields, **select_options)
-    summary = [result.get("summary") for result in res if result.get("summary")]
+    # The search starts the prompt's trace; the answer below joins it
+    with span("search") as search_span:
+        res = search_client.search(search_text=user_prompt, search_fields=search_fields, **select_options)
+        summary = [result.get("summary") for result in res if result.get("summary")]
+        search_span.set("results", len(summary))
+    st.session_state.trace_id = search_span.trace_id
     st.session_state.messages.append({"role": "user", "content": user_prompt})
-    st.session_state.messages.append({"role": "system", "content": " ".join(summary)})
+    st.session_state.retrieved_summary = summary
 
 # Display the existing chat messages
 for message in st.session_state.messages:
     if message["role"] == "system":
         continue
     with st.chat_message(message["role"]):
-        if "results" in message:
+        if "result_id" in message:
+            # Earlier turns show a preview; the full result is read back from disk only when asked for
+            st.dataframe(message["preview"])
+            if message["rows"] > len(message["preview"]) and st.toggle(f"Show all {message['rows']} rows", key=message["result_id"]):
+                full = st.session_state.result_store.load(message["result_id"])
+                if full is None:
+                    st.info("This result is no longer stored, please ask again.")
+                else:
+                    st.dataframe(full)
+        elif "results" in message:
             st.dataframe(message["results"])
         else:
             st.markdown(message["content"])
@@ -71,34 +93,73 @@ for message in st.session_state.messages:
 # If last message is not from assistant, we need to generate a new response
 if st.session_state.messages[-1]["role"] != "assistant":
     with st.chat_message("assistant"):
-        response = ""
-        resp_container = st.empty()
-        for delta in client.chat.completions.create(
-            model=deployment_name,
-            messages=[{"role": m["role"], "content": m["content"]} for m in st.session_state.messages],
-            stream=True,
-        ):
-            if delta.choices:
-                response += (delta.choices[0].delta.content or "")
-        message = {"role": "assistant", "content": response}
-        
-        # Parse the response for a SQL query and execute if available
-        sql_match = re.search(r"```sql\n(.*)\n```", response, re.DOTALL)
-        
-        if sql_match:
-            sql = sql_match.group(1)
-            conn = get_snowflake_connection()
-            cursor = conn.cursor()
-            try:
-                # Run the SQL query and fetch the results
-                cursor.execute(sql)
-                results = cursor.fetchall()
-                columns = [desc[0] for desc in cursor.description]
-                df = pd.DataFrame(results, columns=columns)
-                # Display the results
-                st.dataframe(df)
-                # Update the message to only show that results are displayed
-                message = {"role": "assistant", "content": "Here are the results:", "results": df}
-            except Exception as e:
-                message = {"role": "assistant", "content": f"An error occurred: {e}"}
-        st.session_state.messages.append(message)
+        with span("qna.request", trace_id=st.session_state.get("trace_id")) as request_span:
+            user_prompt = next(m["content"] for m in reversed(st.session_state.messages) if m["role"] == "user")
+            retrieved = st.session_state.get("retrieved_summary", [])
+            cached = answer_cache.lookup(user_prompt, retrieved)
+            request_span.set("answer_cache_hit", cached is not None)
+            query = None
+            if cached:
+                response = cached["response"]
+            else:
+                messages = st.session_state.memory.messages(user_prompt, " ".join(retrieved))
+                with span("llm_completion") as llm_span:
+                    answer = AnswerStream("sql")
+                    resp_container = st.empty()
+                    with llm.stream(messages) as call:
+                        for delta in call.response:
+                            if delta.choices:
+                                blocks = answer.feed(delta.choices[0].delta.content or "")
+                                # The warehouse starts at the closing fence, not after the model's trailing prose
+                                if blocks and query is None:
+                                    # The worker thread runs in a copy of this context so its spans join the trace
+                                    query = get_query_executor().submit(contextvars.copy_context().run, start_query, blocks[0])
+                                resp_container.markdown(answer.text + " ▌")
+                        response = answer.finish()
+                        call.completion_tokens = count_tokens(response)
+                    resp_container.markdown(response)
+                    timings = answer.timings()
+                    logger.debug(f"LLM stream timings: {timings}")
+                    llm_span.update(ttft_s=timings["ttft"], first_block_s=timings["first_block"],
+                                    completion_tokens=call.completion_tokens)
+                request_span.set("prompt_tokens", st.session_state.memory.turn_tokens[-1])
+                st.caption(f"Prompt tokens this turn: {st.session_state.memory.turn_tokens[-1]}")
+            message = {"role": "assistant", "content": response}
+
+            # Parse the response for a SQL query and execute if available
+            sql_match = FENCES["sql"].search(response)
+
+            if sql_match:
+                sql = sql_match.group(1)
+                df = answer_cache.results(cached)
+                request_span.set("result_cache_hit", df is not None)
+                try:
+                    if df is None:
+                        pager = query.result() if query is not None else start_query(sql)
+                        # Display the first batch right away and page in the rest up to the row/byte cap
+                        with span("sql.fetch") as fetch_span:
+                            table = st.empty()
+                            grid = None
+                            for page in pager:
+                                # Later pages are appended to the rendered table instead of re-rendering all of them
+                                if grid is None:
+                                    grid = table.dataframe(page)
+                                else:
+                                    grid.add_rows(page)
+                            df = pager.to_frame()
+                            table.dataframe(df)
+                            fetch_span.update(rows=len(df), bytes=pager.bytes, truncated=pager.truncated)
+                        answer_cache.store(user_prompt, retrieved, response, sql, df)
+                    else:
+                        # Display the results
+                        st.dataframe(df)
+                    truncated = df.attrs.get("truncated", False)
+                    request_span.update(rows=len(df), truncated=truncated)
+                    if truncated:
+                        st.warning(f"Result truncated to the first {len(df)} rows.")
+                    # Update the message to only show that results are displayed
+                    message = {"role": "assistant", "content": "Here are the results:", "results": df, "truncated": truncated}
+                except Exception as e:
+                    message = {"role": "assistant", "content": f"An error occurred: {e}"}
+            st.session_state.memory.add_turn(user_prompt, message["content"])
+            st.session_state.messages.append(st.session_state.result_store.stash(message))
\ No newline at end of file
@@ -0,0 +1,123 @@
+import os
+import pandas as pd
+from logger_module import setup_logger
+
+logger = setup_logger()
+
+# Result size caps from environment variables
+RESULT_MAX_ROWS = int(os.getenv('RESULT_MAX_ROWS', '100000'))
+RESULT_MAX_BYTES = int(os.getenv('RESULT_MAX_BYTES', str(200 * 1024 * 1024)))
+
+
+class _RowsBatch:
+    # Stand-in for connectors/queries that don't expose result batches
+    def __init__(self, rows):
+        self.rowcount = len(rows)
+        self._rows = rows
+
+    def to_pandas(self):
+        from snowflake.connector.errors import NotSupportedError
+        raise NotSupportedError("Rows batch has no arrow data")
+
+    def create_iter(self):
+        return iter(self._rows)
+
+
+def _batch_frame(batch, columns):
+    # Imported here so loading this module doesn't load the connector
+    from snowflake.connector.errors import NotSupportedError
+    try:
+        df = batch.to_pandas()
+    except NotSupportedError:
+        # Small results can come back as JSON chunks instead of Arrow
+        df = pd.DataFrame(list(batch.create_iter()), columns=columns)
+    if df.empty and len(df.columns) == 0:
+        df = pd.DataFrame(columns=columns)
+    return df
+
+
+class ResultPager:
+    """Pages through a query's result batches one DataFrame at a time, stopping at
+    max_rows/max_bytes and recording whether the result was truncated.
+
+    Result batches download independently of the cursor, so the pooled connection can be
+    returned as soon as the pager is built."""
+
+    def __init__(self, batches, columns, max_rows=RESULT_MAX_ROWS, max_bytes=RESULT_MAX_BYTES):
+        self.columns = columns
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.rows = 0
+        self.bytes = 0
+        self.truncated = False
+        self.pages = []
+        self._batches = list(batches)
+        self._next = 0
+
+    @property
+    def exhausted(self):
+        return self.truncated or self._next >= len(self._batches)
+
+    def _more_rows_pending(self):
+        return any(getattr(batch, "rowcount", 1) for batch in self._batches[self._next:])
+
+    def next_page(self):
+        while not self.exhausted:
+            if self.rows >= self.max_rows or self.bytes >= self.max_bytes:
+                self.truncated = self._more_rows_pending()
+                self._next = len(self._batches)
+                return None
+            batch = self._batches[self._next]
+            self._next += 1
+            df = _batch_frame(batch, self.columns)
+            if df.empty:
+                continue
+
+            remaining_rows = self.max_rows - self.rows
+            if len(df) > remaining_rows:
+                df = df.iloc[:remaining_rows]
+                self.truncated = True
+            size = int(df.memory_usage(index=False).sum())
+            if self.bytes + size > self.max_bytes:
+                # Keep the share of this page that still fits in the byte budget
+                keep = int(len(df) * (self.max_bytes - self.bytes) / size)
+                df = df.iloc[:keep]
+                size = int(df.memory_usage(index=False).sum())
+                self.truncated = True
+            if df.empty:
+                return None
+
+            self.rows += len(df)
+            self.bytes += size
+            self.pages.append(df)
+            return df
+        return None
+
+    def __iter__(self):
+        while True:
+            page = self.next_page()
+            if page is None:
+                return
+            yield page
+
+    def to_frame(self):
+        for _ in self:
+            pass
+        if not self.pages:
+            df = pd.DataFrame(columns=self.columns)
+            df.attrs["truncated"] = self.truncated
+            return df
+        df = pd.concat(self.pages, ignore_index=True)
+        df.attrs["truncated"] = self.truncated
+        if self.truncated:
+            logger.info(f"Result truncated at {self.rows} rows / {self.bytes} bytes")
+        return df
+
+
+def fetch_result(cursor, max_rows=RESULT_MAX_ROWS, max_bytes=RESULT_MAX_BYTES):
+    columns = [desc[0] for desc in cursor.description]
+    batches = cursor.get_result_batches()
+    if batches is None:
+        # Never pull more than one row past the cap into memory
+        batches = [_RowsBatch(cursor.fetchmany(max_rows + 1))]
+    return ResultPager(batches, columns, max_rows, max_bytes)
@@ -1,33 +1,14 @@
-try:
-    import os
-    import re
-    from fastapi import HTTPException
-    import snowflake.connector
-    from dotenv import load_dotenv
-    from logger_module import setup_logger
-    import logging
-    from snowflake.sqlalchemy import URL
-    import snowflake.connector
-    import sqlalchemy.pool as pool
-    from sqlalchemy.pool import QueuePool
-    from sqlalchemy import create_engine
-    from sqlalchemy import exc
-    import json
-    import time
-    import traceback
-    from datetime import datetime
-    from decimal import Decimal
-    from cryptography.hazmat.backends import default_backend
-    from cryptography.hazmat.primitives import serialization
-    import streamlit as st
-    from openai import AzureOpenAI
-    from prompts import get_system_prompt
-    from dotenv import load_dotenv
-
-except Exception as e:
-    logging.info("####Import Error")
-    logging.exception("Error in import", exc_info=True)
-    logging.info(e)
+import os
+import time
+import functools
+import threading
+import traceback
+from contextlib import contextmanager
+from sqlalchemy import exc, event
+from sqlalchemy.pool import QueuePool
+from dotenv import load_dotenv
+from services import lazy_service
+from logger_module import setup_logger
 
 # Load environment variables from .env file if present
 load_dotenv()
@@ -35,32 +16,35 @@ load_dotenv()
 # Initialize the custom logger
 logger = setup_logger()
 
-sf_key = os.getenv("SNOWFLAKE_PRIVATE_KEY")
-
-logger.info("SF key read successfully ...")
+@lazy_service
+def get_private_key():
+    # Decrypted on the first connection instead of at import
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
 
-private_key_encoded = sf_key.encode()
+    sf_key = os.getenv("SNOWFLAKE_PRIVATE_KEY")
 
-logger.info("SF key encoded ...")
+    private_key_encoded = sf_key.encode()
 
-### Encode the private key passphrase
-private_key_passphrase = os.getenv("daas_edp_sf_key_passphrase")
-private_key_passphrase_encoded = private_key_passphrase.encode()
+    ### Encode the private key passphrase
+    private_key_passphrase = os.getenv("daas_edp_sf_key_passphrase")
+    private_key_passphrase_encoded = private_key_passphrase.encode()
 
-### Load the private key, leveraging passphrase if needed
-private_key_loaded = serialization.load_pem_private_key(
-    private_key_encoded,
-    password=private_key_passphrase_encoded,
-    backend=default_backend(),
-)
+    ### Load the private key, leveraging passphrase if needed
+    private_key_loaded = serialization.load_pem_private_key(
+        private_key_encoded,
+        password=private_key_passphrase_encoded,
+        backend=default_backend(),
+    )
 
-## Serialize loaded private key
-private_key_serialized = private_key_loaded.private_bytes(
-    encoding=serialization.Encoding.DER,
-    format=serialization.PrivateFormat.PKCS8,
-    encryption_algorithm=serialization.NoEncryption(),
-)
-logging.info("Completed decrypting the private key file")
+    ## Serialize loaded private key
+    private_key_serialized = private_key_loaded.private_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    )
+    logger.info("Completed decrypting the private key file")
+    return private_key_serialized
 
 # For DAAS SF TARGET
 # Fetch Snowflake Configurations from environment variables
@@ -71,11 +55,12 @@ SNOWFLAKE_WAREHOUSE = os.getenv('SNOWFLAKE_WAREHOUSE')
 SNOWFLAKE_DATABASE = os.getenv('SNOWFLAKE_DATABASE')
 SNOWFLAKE_SCHEMA = os.getenv('SNOWFLAKE_SCHEMA')
 SNOWFLAKE_ROLE = os.getenv('SNOWFLAKE_ROLE')
-SNOWFLAKE_PRIVATE_KEY = private_key_serialized #os.getenv('SNOWFLAKE_PRIVATE_KEY')
 SNOWFLAKE_TABLE = os.getenv('SNOWFLAKE_TABLE')
+SNOWFLAKE_STATEMENT_TIMEOUT = int(os.getenv('SNOWFLAKE_STATEMENT_TIMEOUT', '300'))
 
 # Function to get a raw Snowflake connection
 def get_conn():
+    import snowflake.connector
     try:
         return snowflake.connector.connect(
             user=SNOWFLAKE_USER,
@@ -85,8 +70,9 @@ def get_conn():
             database=SNOWFLAKE_DATABASE,
             schema=SNOWFLAKE_SCHEMA,
             role=SNOWFLAKE_ROLE,
-            private_key=SNOWFLAKE_PRIVATE_KEY,            
-            client_session_keep_alive=True
+            private_key=get_private_key(),            
+            client_session_keep_alive=True,
+            session_parameters={'STATEMENT_TIMEOUT_IN_SECONDS': SNOWFLAKE_STATEMENT_TIMEOUT}
         )
     except Exception as e:
         logger.error(f"Error establishing Snowflake connection: {str(e)}")
@@ -117,16 +103,121 @@ def get_conn():
 #         logger.error(f"Error establishing Snowflake connection: {str(e)}")
 #         raise
 
-# Create a QueuePool with the provided specifications
-pool = QueuePool(get_conn, max_overflow=int(os.getenv('SF_POOL_MAX_OVERFLOW')), pool_size=int(os.getenv('SF_POOL_SIZE')), timeout=float(os.getenv('SF_POOL_TIMEOUT')))
+# Pool lifecycle configurations from environment variables
+SF_POOL_RECYCLE = int(os.getenv('SF_POOL_RECYCLE', '3600'))  # Replace sessions older than this (seconds)
+SF_POOL_PING_AFTER = float(os.getenv('SF_POOL_PING_AFTER', '300'))  # Ping sessions idle longer than this before reuse
+SF_POOL_LEAK_SECONDS = float(os.getenv('SF_POOL_LEAK_SECONDS', '120'))  # Checkouts held longer than this are reported
+SF_POOL_TRACK_STACKS = os.getenv('SF_POOL_TRACK_STACKS', 'true').lower() == 'true'
+
+
+_pool_metrics = {
+    "checkouts": 0,
+    "checkins": 0,
+    "checkout_timeouts": 0,
+    "stale_sessions_replaced": 0,
+    "long_checkouts": 0,
+    "checkout_seconds_total": 0.0,
+    "checkout_seconds_max": 0.0,
+}
+_pool_metrics_lock = threading.Lock()
+_checked_out = {}
+
+def _count(name, value=1):
+    with _pool_metrics_lock:
+        _pool_metrics[name] += value
+
+def _caller_stack():
+    # Drop pool/SQLAlchemy frames so the stack ends at the code that checked the connection out
+    plumbing = {"_on_checkout", "_caller_stack", "get_snowflake_connection", "snowflake_connection", "snowflake_cursor", "wrapper"}
+    frames = [frame for frame in traceback.extract_stack()
+              if 'sqlalchemy' not in frame.filename and not frame.filename.endswith('contextlib.py')
+              and frame.name not in plumbing]
+    return "".join(traceback.format_list(frames[-15:]))
+
+def _session_alive(dbapi_connection):
+    try:
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        finally:
+            cursor.close()
+        return True
+    except Exception:
+        return False
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    now = time.monotonic()
+    idle_since = connection_record.info.get("checked_in_at")
+    if dbapi_connection.is_closed() or (idle_since is not None and now - idle_since > SF_POOL_PING_AFTER
+                                        and not _session_alive(dbapi_connection)):
+        # The pool invalidates this record and retries the checkout with a fresh session
+        _count("stale_sessions_replaced")
+        raise exc.DisconnectionError("Stale Snowflake session")
+    connection_record.info["checked_out_at"] = now
+    connection_record.info["checkout_stack"] = _caller_stack() if SF_POOL_TRACK_STACKS else None
+    _checked_out[id(connection_record)] = connection_record
+    _count("checkouts")
+
+def _on_checkin(dbapi_connection, connection_record):
+    now = time.monotonic()
+    _checked_out.pop(id(connection_record), None)
+    connection_record.info["checked_in_at"] = now
+    started = connection_record.info.pop("checked_out_at", None)
+    stack = connection_record.info.pop("checkout_stack", None)
+    if started is None:
+        return
+    held = now - started
+    with _pool_metrics_lock:
+        _pool_metrics["checkins"] += 1
+        _pool_metrics["checkout_seconds_total"] += held
+        _pool_metrics["checkout_seconds_max"] = max(_pool_metrics["checkout_seconds_max"], held)
+    if held > SF_POOL_LEAK_SECONDS:
+        _count("long_checkouts")
+        logger.warning(f"Snowflake connection held for {held:.1f}s. Checked out at:\n{stack}")
+
+def report_leaked_connections(min_seconds=SF_POOL_LEAK_SECONDS):
+    now = time.monotonic()
+    leaks = []
+    for record in list(_checked_out.values()):
+        started = record.info.get("checked_out_at")
+        if started is not None and now - started > min_seconds:
+            leaks.append((now - started, record.info.get("checkout_stack")))
+    for held, stack in sorted(leaks, key=lambda leak: leak[0], reverse=True):
+        logger.warning(f"Possible leaked Snowflake connection, held for {held:.1f}s. Checked out at:\n{stack}")
+    return leaks
+
+@lazy_service
+def get_pool():
+    # Create a QueuePool with the provided specifications
+    pool = QueuePool(get_conn, max_overflow=int(os.getenv('SF_POOL_MAX_OVERFLOW')), pool_size=int(os.getenv('SF_POOL_SIZE')), timeout=float(os.getenv('SF_POOL_TIMEOUT')), recycle=SF_POOL_RECYCLE)
+    event.listen(pool, "checkout", _on_checkout)
+    event.listen(pool, "checkin", _on_checkin)
+    return pool
+
+def warm_up():
+    # Pay for the connector import and key decryption off the request path
+    import snowflake.connector
+    get_private_key()
+
+def pool_metrics():
+    with _pool_metrics_lock:
+        metrics = dict(_pool_metrics)
+    # Reporting must not build the pool
+    if get_pool.is_built():
+        pool = get_pool()
+        metrics.update({"pool_size": pool.size(), "checked_out": pool.checkedout(), "overflow": pool.overflow()})
+    return metrics
 
 def get_snowflake_connection():
     try:
-        conn = pool.connect()
-        logger.info("Snowflake connection established successfully.")
-        logger.info("======================Printing Pool Status===============================")
-        logger.info("Pool Status: " + pool.status())
+        conn = get_pool().connect()
         return conn
+    except exc.TimeoutError as e:
+        # Pool exhausted: show who is holding the connections
+        _count("checkout_timeouts")
+        report_leaked_connections(min_seconds=0)
+        logger.info(f"Failed to get connection from Snowflake pool: {str(e)}")
+        raise
     except Exception as e:
         logger.info(f"Failed to get connection from Snowflake pool: {str(e)}")
         raise
@@ -135,33 +226,52 @@ def close_snowflake_connection(conn):
     try:
         if conn:
             conn.close()
-            logger.info("======================Printing Pool Status===============================")
-            logger.info("Pool Status: " + pool.status())
-            logger.info("Snowflake connection closed successfully.")
     except Exception as e:
         logger.info(f"Error closing Snowflake connection: {str(e)}")
 
+@contextmanager
+def snowflake_connection():
+    conn = get_snowflake_connection()
+    try:
+        yield conn
+    finally:
+        close_snowflake_connection(conn)
+
+@contextmanager
+def snowflake_cursor():
+    with snowflake_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+def with_snowflake_cursor(func):
+    # Decorator: passes a pooled cursor as the first argument and always returns it to the pool
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with snowflake_cursor() as cursor:
+            return func(cursor, *args, **kwargs)
+    return wrapper
+
 def validate_snowflake_source(dbObject):
     properties = {}
-    conn = get_snowflake_connection()
-    cursor = conn.cursor()
     # Checking whether snowflake TABLE even exists in the db.
     describe_query = f""" DESCRIBE TABLE {os.getenv('SNOWFLAKE_DATABASE')}.{os.getenv('SNOWFLAKE_SCHEMA')}.{dbObject}"""
-    try:
-        cursor.execute(describe_query)    
-        metadata = cursor.fetchall()
-
-        logger.info(f"In Create DaaS Config : Describe Query executed Successfully. Printing Metadata: \n\n")
-        logger.info(f"{metadata}")
-
-        column_names = [row[0] for row in metadata]
-        #for column_name in column_names:
-        properties[dbObject] = column_names
-        logger.info(f"Printing properties:\n {properties} \n")
-
-        cursor.close()
-        return metadata
-    except snowflake.connector.errors.ProgrammingError as e:            
-        logger.info(f"Exception occured while validating the Snowflake datasource object {dbObject}. Details: {e} \n\n")
-        raise HTTPException(status_code=400, detail=f"Snowflake Object: {dbObject} doesn't exist or not authorized for access. Please check logs for more details.")
-    close_snowflake_connection(conn)
\ No newline at end of file
+    import snowflake.connector
+    from fastapi import HTTPException
+    with snowflake_cursor() as cursor:
+        try:
+            cursor.execute(describe_query)
+            metadata = cursor.fetchall()
+            # Column count only; the full DESCRIBE payload is too large for the hot path
+            logger.debug(f"DESCRIBE {dbObject}: {len(metadata)} columns")
+
+            column_names = [row[0] for row in metadata]
+            #for column_name in column_names:
+            properties[dbObject] = column_names
+
+            return metadata
+        except snowflake.connector.errors.ProgrammingError as e:
+            logger.info(f"Exception occured while validating the Snowflake datasource object {dbObject}. Details: {e} \n\n")
+            raise HTTPException(status_code=400, detail=f"Snowflake Object: {dbObject} doesn't exist or not authorized for access. Please check logs for more details.")
\ No newline at end of file
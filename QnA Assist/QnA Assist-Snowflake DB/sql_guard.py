@@ -0,0 +1,99 @@
+import os
+import json
+import sqlglot
+from sqlglot import exp
+from result_fetch import RESULT_MAX_ROWS
+from logger_module import setup_logger
+
+logger = setup_logger()
+
+# Pre-execution guard configurations from environment variables
+SQL_GUARD_MAX_ROWS = int(os.getenv('SQL_GUARD_MAX_ROWS', str(RESULT_MAX_ROWS)))
+SQL_GUARD_MAX_BYTES_SCANNED = int(os.getenv('SQL_GUARD_MAX_BYTES_SCANNED', str(50 * 1024 ** 3)))
+SQL_GUARD_MAX_PARTITIONS = int(os.getenv('SQL_GUARD_MAX_PARTITIONS', '100000'))
+SQL_GUARD_OVER_BUDGET = os.getenv('SQL_GUARD_OVER_BUDGET', 'refuse')  # refuse | limit
+SQL_GUARD_OVER_BUDGET_ROWS = int(os.getenv('SQL_GUARD_OVER_BUDGET_ROWS', '1000'))
+SQL_GUARD_EXPLAIN = os.getenv('SQL_GUARD_EXPLAIN', 'true').lower() == 'true'
+
+
+class SqlGuardError(Exception):
+    pass
+
+
+def parse_select(sql):
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read="snowflake") if statement is not None]
+    except sqlglot.errors.SqlglotError as e:
+        raise SqlGuardError(f"Could not parse the generated SQL: {e}")
+    if len(statements) != 1:
+        raise SqlGuardError("Only a single SQL statement can be executed.")
+    statement = statements[0]
+    if not isinstance(statement, exp.Query):
+        raise SqlGuardError(f"Only SELECT statements are allowed, got {statement.key.upper()}.")
+    return statement
+
+def _row_count(limit):
+    """Literal row count of a LIMIT or FETCH clause; None when it can't be read (a parameter, an
+    expression, FETCH ... PERCENT or WITH TIES)."""
+    if isinstance(limit, exp.Fetch):
+        options = limit.args.get("limit_options")
+        if options is not None and (options.args.get("percent") or options.args.get("with_ties")):
+            return None
+        value = limit.args.get("count")
+    else:
+        value = limit.expression
+    if isinstance(value, exp.Literal) and value.is_int:
+        return int(value.this)
+    return None
+
+def apply_limit(statement, max_rows):
+    # One row past the cap is fetched so the result fetcher can tell the caller it was truncated
+    cap = max_rows + 1
+    limit = statement.args.get("limit")
+    if limit is None:
+        return statement.limit(cap)
+    rows = _row_count(limit)
+    if rows is None:
+        # Keep the model's own limit and cap around it
+        return exp.select("*").from_(statement.subquery("_guarded")).limit(cap)
+    return statement if rows <= cap else statement.limit(cap)
+
+def prepare_select(sql, max_rows=SQL_GUARD_MAX_ROWS):
+    """Reject anything but a single SELECT and inject or tighten its LIMIT."""
+    return apply_limit(parse_select(sql), max_rows).sql(dialect="snowflake")
+
+def estimate_scan(cursor, sql):
+    cursor.execute(f"EXPLAIN USING JSON {sql}")
+    plan = json.loads(cursor.fetchone()[0])
+    stats = plan.get("GlobalStats", {})
+    return {
+        "partitions_total": stats.get("partitionsTotal", 0),
+        "partitions_assigned": stats.get("partitionsAssigned", 0),
+        "bytes_assigned": stats.get("bytesAssigned", 0),
+    }
+
+def over_budget(estimate):
+    return (estimate["bytes_assigned"] > SQL_GUARD_MAX_BYTES_SCANNED
+            or estimate["partitions_assigned"] > SQL_GUARD_MAX_PARTITIONS)
+
+def guard_sql(cursor, sql, max_rows=SQL_GUARD_MAX_ROWS):
+    """Returns the SQL that is safe to execute, or raises SqlGuardError."""
+    guarded = prepare_select(sql, max_rows)
+    if not SQL_GUARD_EXPLAIN:
+        return guarded
+
+    estimate = estimate_scan(cursor, guarded)
+    if not over_budget(estimate):
+        return guarded
+
+    logger.info(f"Query over scan budget: {estimate}")
+    if SQL_GUARD_OVER_BUDGET == 'limit':
+        # A LIMIT only prunes the scan when nothing (GROUP BY, ORDER BY, a join) needs every row first
+        limited = prepare_select(guarded, min(max_rows, SQL_GUARD_OVER_BUDGET_ROWS))
+        estimate = estimate_scan(cursor, limited)
+        if not over_budget(estimate):
+            return limited
+        logger.info(f"Limited query still over scan budget: {estimate}")
+    raise SqlGuardError(
+        f"Query refused: it would scan {estimate['bytes_assigned'] / 1024 ** 3:.1f} GB across "
+        f"{estimate['partitions_assigned']} partitions, over the configured budget. Please narrow the question.")
@@ -0,0 +1,19 @@
+import os
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+TOKENIZER_ENCODING = os.getenv('TOKENIZER_ENCODING', 'cl100k_base')
+
+_encoding = None
+
+def count_tokens(text):
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        return len(_encoding.encode(text))
+    # Rough fallback when tiktoken isn't installed: ~4 characters per token
+    return (len(text) + 3) // 4
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import random
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+from logger_module import setup_logger, get_correlation_id, correlation_id
+
+logger = setup_logger()
+
+# Tracing configurations from environment variables
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'json')  # json | otel | none
+TRACING_FILE = os.getenv('TRACING_FILE')  # JSON lines file; spans go to the application log when unset
+TRACING_SAMPLE_RATE = float(os.getenv('TRACING_SAMPLE_RATE', '1.0'))
+
+_current = contextvars.ContextVar("qna_span", default=None)
+
+
+class Span:
+    """Built-in span with OpenTelemetry-style ids; exported as one JSON object when it ends."""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "sampled", "start_ns", "end_ns", "attributes", "status")
+
+    def __init__(self, name, parent=None, trace_id=None, attributes=None):
+        self.name = name
+        self.span_id = f"{random.getrandbits(64):016x}"
+        if parent is not None:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self.sampled = parent.sampled
+        else:
+            self.trace_id = trace_id or f"{random.getrandbits(128):032x}"
+            self.parent_id = None
+            self.sampled = random.random() < TRACING_SAMPLE_RATE
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def update(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration_ms(self):
+        end = self.end_ns or time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_dict(self):
+        return {"name": self.name, "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "start_ns": self.start_ns, "end_ns": self.end_ns, "duration_ms": round(self.duration_ms, 3),
+                "status": self.status, "attributes": self.attributes}
+
+
+class _JsonExporter:
+    def __init__(self, path=TRACING_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        if self.path is None:
+            logger.info(f"span {line}")
+            return
+        with self._lock:
+            with open(self.path, 'a') as file:
+                file.write(line + "\n")
+
+
+class _OtelSpan:
+    # Same set()/update() surface over an OpenTelemetry span
+    def __init__(self, span):
+        self._span = span
+        self.trace_id = f"{span.get_span_context().trace_id:032x}"
+
+    def set(self, key, value):
+        if value is not None:
+            self._span.set_attribute(key, value if isinstance(value, (str, bool, int, float)) else str(value))
+
+    def update(self, **attributes):
+        for key, value in attributes.items():
+            self.set(key, value)
+
+
+_exporter = _JsonExporter() if TRACING_EXPORTER == 'json' else None
+_tracer = None
+if TRACING_EXPORTER == 'otel':
+    try:
+        from opentelemetry import trace as otel_trace
+        _tracer = otel_trace.get_tracer("qna-assist")
+    except ImportError:
+        logger.info("TRACING_EXPORTER=otel but opentelemetry is not installed, falling back to JSON spans")
+        _exporter = _JsonExporter()
+
+
+@contextmanager
+def span(name, trace_id=None, **attributes):
+    """Time a block as a child of the current span (or a new trace). Attributes can be added
+    on the yielded span with set()/update(). Context flows into asyncio tasks and to_thread calls."""
+    if _tracer is not None:
+        with _tracer.start_as_current_span(name, attributes=attributes) as otel_span:
+            yield _OtelSpan(otel_span)
+        return
+    current = Span(name, parent=_current.get(), trace_id=trace_id, attributes=attributes)
+    token = _current.set(current)
+    # A new trace also tags the request's log records, unless the caller already did
+    log_context = correlation_id(current.trace_id) if get_correlation_id() is None else nullcontext()
+    try:
+        with log_context:
+            yield current
+    except BaseException as e:
+        current.status = f"error: {type(e).__name__}"
+        raise
+    finally:
+        _current.reset(token)
+        current.end_ns = time.time_ns()
+        if _exporter is not None and current.sampled:
+            _exporter.export(current)
+
+
+def current_span():
+    if _tracer is not None:
+        return _OtelSpan(otel_trace.get_current_span())
+    return _current.get()
+
+
+def annotate(**attributes):
+    """Add attributes to the current span, if there is one."""
+    current = current_span()
+    if current is not None:
+        current.update(**attributes)